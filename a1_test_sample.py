@@ -19,11 +19,30 @@ Note: this file is for support purposes only, and is not part of your
 submission.
 """
 from datetime import datetime, timedelta
+import gc
 import os
+import shutil
+import weakref
+import numpy as np
 import pygame
-from pytest import approx
-from bikeshare import Ride, Station
-from simulation import Simulation, create_stations, create_rides
+from pytest import approx, raises
+from time import sleep
+from benchmark import benchmark, generate_rides, generate_stations
+from bikeshare import Drawable, Ride, Station, drawable_positions, \
+    group_stations
+from container import PriorityQueue
+from datacache import cached_ride_table, cached_stations
+from frameexport import FrameWriter
+from instruments import Instruments
+from leaderboard import Leaderboard
+from occupancy import OccupancyHistory
+from ridestore import DATETIME_FORMAT, RideIndex, TimestampParser, \
+    create_ride_table, parse_minutes, to_minute
+from scenarios import Scenario, run_scenarios
+from simulation import Event, Simulation, RideStartEvent, \
+    create_stations, create_rides, sample_simulation
+from spatialgrid import SpatialGrid
+from visualizer import CLUSTER_MAX_ZOOM, Map, SCREEN_SIZE
 
 
 ###############################################################################
@@ -431,6 +450,1057 @@ def test_case_7_and_4_2():
     assert stats["max_end"] == ("de Bordeaux / Jean-Talon", 3)
 
 
+def test_priority_queue_fifo_ties():
+    """
+    Events with equal times leave the queue in the order they were added,
+    whether they were added one at a time or in a batch.
+    """
+    stations = create_stations('stations.json')
+    rides = create_rides('sample_rides.csv', stations)
+    # The rides in sample_rides.csv from 8:16 to 8:17 all share a start time.
+    tied = [RideStartEvent(None, ride.start_time, ride) for ride in rides
+            if ride.start_time == datetime(2017, 7, 1, 8, 16, 0)]
+    assert len(tied) == 5
+
+    pq = PriorityQueue(Event.key)
+    pq.add(tied[0])
+    pq.add_many(tied[1:])
+    assert pq.peek() is tied[0]
+    assert [pq.remove() for _ in range(5)] == tied
+    assert pq.is_empty()
+
+
+def test_skip_idle_matches_per_minute_run():
+    """
+    Jumping from event to event gives the same station state and statistics
+    as stepping through every minute.
+    """
+    sims = []
+    for skip_idle in [False, True]:
+        sim = Simulation('stations.json', 'sample_rides.csv', headless=True)
+        sim.run(datetime(2017, 7, 1, 7, 30, 0),
+                datetime(2017, 7, 1, 8, 25, 0), skip_idle=skip_idle)
+        sims.append(sim)
+
+    minute, skip = sims
+    assert skip.calculate_statistics() == minute.calculate_statistics()
+    for id_, station in minute.all_stations.items():
+        other = skip.all_stations[id_]
+        assert (other.num_bikes, other.tla, other.tlu) == \
+            (station.num_bikes, station.tla, station.tlu)
+
+
+def _check_second_run(options: dict, first_skip: bool,
+                      second_skip: bool) -> None:
+    """Run a simulation made with <options> over two consecutive windows,
+    and check that its second run matches the same window run by a fresh
+    simulation that starts from the stations left by the first run.
+    """
+    first = (datetime(2017, 7, 1, 7, 30), datetime(2017, 7, 1, 7, 45))
+    second = (datetime(2017, 7, 1, 7, 50), datetime(2017, 7, 1, 8, 25))
+    sim = Simulation('stations.json', 'sample_rides.csv', headless=True,
+                     **options)
+    sim.run(*first, skip_idle=first_skip)
+    left = {id_: (s.capacity, s.num_bikes)
+            for id_, s in sim.all_stations.items()}
+    before = {id_: (s.start, s.end, s.tla, s.tlu)
+              for id_, s in sim.all_stations.items()}
+    sim.run(*second, skip_idle=second_skip)
+
+    fresh = Simulation('stations.json', 'sample_rides.csv', headless=True,
+                       **options)
+    fresh.reset(left)
+    fresh.run(*second, skip_idle=second_skip)
+    for id_, station in fresh.all_stations.items():
+        other = sim.all_stations[id_]
+        start, end, tla, tlu = before[id_]
+        assert (other.num_bikes, other.start - start, other.end - end,
+                other.tla - tla, other.tlu - tlu) == \
+            (station.num_bikes, station.start, station.end, station.tla,
+             station.tlu)
+    assert [(r.start_time, r.end_time) for r in sim.active_rides] == \
+        [(r.start_time, r.end_time) for r in fresh.active_rides]
+
+
+def test_consecutive_runs():
+    """
+    A second run of a simulation processes its window like a fresh
+    simulation would, with no events or active rides left over from the
+    first run, whichever way each run steps through time.
+    """
+    for options in [{}, {'columnar': True}, {'live_stats': True}]:
+        for first_skip, second_skip in [(False, False), (True, True),
+                                        (False, True), (True, False)]:
+            _check_second_run(options, first_skip, second_skip)
+
+
+def test_headless_simulation():
+    """
+    A headless simulation never opens a window, and its run returns without
+    waiting for the window to be closed.
+    """
+    pygame.display.quit()
+    sim = Simulation('stations.json', 'sample_rides.csv', headless=True)
+    assert sim.visualizer is None
+
+    sim.run(datetime(2017, 6, 1, 9, 30, 0),
+            datetime(2017, 6, 1, 9, 45, 0))
+    assert not pygame.display.get_init()
+    assert sim.calculate_statistics()['max_start'] == (
+        sim.all_stations['6091'].name,
+        1
+    )
+    assert len(sample_simulation(headless=True)) == 4
+
+
+def test_active_rides_tracked_by_time():
+    """
+    Rides become active at their start time, are still active at their end
+    time, leave active_rides after it, and a ride from an empty station
+    never becomes active.
+    """
+    sim = Simulation('stations.json', 'sample_rides.csv', headless=True)
+    sim.run(datetime(2017, 7, 1, 7, 30, 0),
+            datetime(2017, 7, 1, 7, 40, 0))
+    assert isinstance(sim.active_rides, list)
+    assert [ride.start_time for ride in sim.active_rides] == [
+        datetime(2017, 7, 1, 7, 31, 0)
+    ]
+
+    for skip_idle in [False, True]:
+        sim = Simulation('stations.json', 'sample_rides.csv', headless=True)
+        sim.run(datetime(2017, 7, 1, 7, 30, 0),
+                datetime(2017, 7, 1, 7, 54, 0), skip_idle=skip_idle)
+        assert [ride.end_time for ride in sim.active_rides] == [
+            datetime(2017, 7, 1, 7, 54, 0)
+        ]
+
+    sim = Simulation('stations.json', 'sample_rides.csv', headless=True)
+    sim.run(datetime(2017, 7, 1, 7, 30, 0),
+            datetime(2017, 7, 1, 7, 55, 0))
+    assert not sim.active_rides
+
+    # Station 6159 has no bikes when the ride at 8:06 should start.
+    sim = Simulation('stations.json', 'sample_rides.csv', headless=True)
+    sim.run(datetime(2017, 7, 1, 8, 6, 0),
+            datetime(2017, 7, 1, 8, 8, 0))
+    assert not sim.active_rides
+
+
+def test_create_ride_table_simple():
+    """Test reading the sample rides into a RideTable.
+    """
+    stations = create_stations('stations.json')
+    rides = create_rides('sample_rides.csv', stations)
+    table = create_ride_table('sample_rides.csv', stations)
+    assert len(table) == len(rides)
+
+    station_list = [stations[id_] for id_ in table.station_ids]
+    ride = table.ride(0, station_list)
+    assert ride.start is stations['6134']
+    assert ride.end is stations['6721']
+    assert ride.start_time == datetime(2017, 6, 1, 7, 31, 0)
+    assert ride.end_time == datetime(2017, 6, 1, 7, 54, 0)
+    assert table.duration[0] == 23
+
+
+def test_columnar_simulation_matches_rides():
+    """
+    Running a columnar simulation gives the same results as running on Ride
+    objects, whether it steps every minute or skips idle minutes.
+    """
+    start = datetime(2017, 7, 1, 7, 30, 0)
+    end = datetime(2017, 7, 1, 8, 25, 0)
+    sim = Simulation('stations.json', 'sample_rides.csv', headless=True)
+    sim.run(start, end)
+    expected = sim.calculate_statistics()
+
+    for skip_idle in [False, True]:
+        columnar = Simulation('stations.json', 'sample_rides.csv',
+                              headless=True, columnar=True)
+        columnar.run(start, end, skip_idle=skip_idle)
+        assert columnar.calculate_statistics() == expected
+        for id_, station in sim.all_stations.items():
+            assert columnar.all_stations[id_].num_bikes == station.num_bikes
+
+    # The active rides of a columnar simulation are Ride objects too.
+    middle = datetime(2017, 7, 1, 8, 17, 0)
+    sim = Simulation('stations.json', 'sample_rides.csv', headless=True)
+    sim.run(start, middle)
+    columnar = Simulation('stations.json', 'sample_rides.csv',
+                          headless=True, columnar=True)
+    columnar.run(start, middle)
+    assert len(sim.active_rides) == 5
+    assert [(ride.start.name, ride.start_time, ride.end_time)
+            for ride in columnar.active_rides] == \
+        [(ride.start.name, ride.start_time, ride.end_time)
+         for ride in sim.active_rides]
+
+
+def test_timestamp_parser_matches_strptime():
+    """
+    The fast timestamp parsers accept exactly what datetime.strptime accepts,
+    including hours that are not zero-padded, and reject malformed times.
+    """
+    parser = TimestampParser()
+    for text in ['2017-06-01 08:00', '2017-06-01 8:00', '2017-6-1 8:05',
+                 '2016-02-29 23:59', '2017-06-01  08:00']:
+        expected = datetime.strptime(text, DATETIME_FORMAT)
+        assert parser.parse(text) == expected
+        assert parser.parse_minute(text) == to_minute(expected)
+        assert parse_minutes([text]).tolist() == [to_minute(expected)]
+
+    for text in ['2017-02-29 08:00', '2017-06-01 24:00', '2017-06-01 08:60',
+                 '2017-06-01 08:00 ', '17-06-01 08:00', '2017-06-01',
+                 '0000-01-01 00:00']:
+        with raises(ValueError):
+            parser.parse(text)
+        with raises(ValueError):
+            parse_minutes(['2017-06-01 08:00', text])
+
+
+def test_streaming_simulation_matches_rides():
+    """
+    A streaming simulation reads its rides while it runs, and gives the same
+    results as a simulation that loads all its rides first.
+    """
+    start = datetime(2017, 6, 1, 8, 0, 0)
+    end = datetime(2017, 6, 1, 9, 0, 0)
+    sim = Simulation('stations.json', 'sample_rides.csv', headless=True)
+    sim.run(start, end)
+    expected = sim.calculate_statistics()
+
+    for skip_idle in [False, True]:
+        streaming = Simulation('stations.json', 'sample_rides.csv',
+                               headless=True, streaming=True)
+        assert streaming.all_rides == []
+        streaming.run(start, end, skip_idle=skip_idle)
+        assert streaming.calculate_statistics() == expected
+        assert len(streaming.active_rides) == len(sim.active_rides)
+
+    # A second run reads the file again from its start, and leaves no end
+    # events from the first run behind.
+    later = (datetime(2017, 7, 1, 7, 30, 0), datetime(2017, 7, 1, 8, 25, 0))
+    for skip_idle in [False, True]:
+        streaming = Simulation('stations.json', 'sample_rides.csv',
+                               headless=True, streaming=True)
+        listed = Simulation('stations.json', 'sample_rides.csv',
+                            headless=True)
+        for sim in [streaming, listed]:
+            sim.run(start, end, skip_idle=skip_idle)
+            sim.run(*later, skip_idle=skip_idle)
+        assert streaming.calculate_statistics() == \
+            listed.calculate_statistics()
+        assert [(s.num_bikes, s.start, s.end, s.tla, s.tlu)
+                for s in streaming.all_stations.values()] == \
+            [(s.num_bikes, s.start, s.end, s.tla, s.tlu)
+             for s in listed.all_stations.values()]
+        assert [(r.start_time, r.end_time)
+                for r in streaming.active_rides] == \
+            [(r.start_time, r.end_time) for r in listed.active_rides]
+    _check_second_run({'streaming': True}, False, True)
+    _check_second_run({'streaming': True}, True, True)
+
+
+def test_streaming_simulation_unsorted_rides(tmp_path):
+    """
+    A streaming simulation rejects a rides file that is not in order of
+    start time.
+    """
+    with open('sample_rides.csv') as file:
+        lines = file.readlines()
+    rides_file = tmp_path / 'rides.csv'
+    rides_file.write_text(lines[4] + lines[3])
+
+    sim = Simulation('stations.json', str(rides_file), headless=True,
+                     streaming=True)
+    with raises(ValueError):
+        sim.run(datetime(2017, 6, 1, 8, 0, 0),
+                datetime(2017, 6, 1, 9, 0, 0))
+
+    # Rides that start before the run are checked too.
+    with raises(ValueError):
+        sim.run(datetime(2017, 6, 2, 8, 0, 0),
+                datetime(2017, 6, 2, 9, 0, 0))
+
+    # Once the file is in order, the failed runs leave nothing behind.
+    rides_file.write_text(lines[3] + lines[4])
+    expected = Simulation('stations.json', str(rides_file), headless=True)
+    for simulation in [sim, expected]:
+        simulation.reset()
+        simulation.run(datetime(2017, 6, 1, 8, 0, 0),
+                       datetime(2017, 6, 1, 9, 0, 0))
+    assert sim.calculate_statistics() == expected.calculate_statistics()
+    assert len(sim.active_rides) == len(expected.active_rides)
+
+
+def test_cached_stations_and_rides(tmp_path):
+    """
+    Cached stations and rides match freshly parsed ones, and a cache entry
+    is replaced when its source file changes.
+    """
+    cache_dir = str(tmp_path / 'cache')
+    rides_file = str(tmp_path / 'rides.csv')
+    shutil.copy('sample_rides.csv', rides_file)
+
+    fresh = create_stations('stations.json')
+    for _ in range(2):  # The second time, everything comes from the cache.
+        stations = cached_stations('stations.json', cache_dir,
+                                   create_stations)
+        assert list(stations) == list(fresh)
+        for id_, station in fresh.items():
+            assert stations[id_].name == station.name
+            assert stations[id_].location == station.location
+            assert stations[id_].capacity == station.capacity
+            assert stations[id_].num_bikes == station.num_bikes
+
+        table = cached_ride_table(rides_file, stations, cache_dir)
+        expected = create_ride_table(rides_file, stations)
+        assert table.start_minute.tolist() == expected.start_minute.tolist()
+        assert table.end_station.tolist() == expected.end_station.tolist()
+    # Cached columns are memory-mapped read-only.
+    assert not table.start_minute.flags.writeable
+
+    def saved_columns() -> list:
+        """Return the inodes of the files of the cached rides."""
+        return sorted(os.stat(os.path.join(root, name)).st_ino
+                      for root, _, names in os.walk(cache_dir)
+                      if os.path.basename(root).startswith('rides-')
+                      for name in names)
+
+    # A cache hit reads the entry back without writing it again.
+    saved = saved_columns()
+    assert saved
+    cached_ride_table(rides_file, stations, cache_dir)
+    assert saved_columns() == saved
+
+    # A cache miss, after the file changes, replaces the entry.
+    with open(rides_file) as file:
+        lines = file.readlines()
+    with open(rides_file, 'w') as file:
+        file.writelines(lines[1:])
+    old_start = table.start_minute
+    table = cached_ride_table(rides_file, stations, cache_dir)
+    assert len(table) == len(expected) - 1
+    assert table.start_minute.tolist() == \
+        create_ride_table(rides_file, stations).start_minute.tolist()
+    assert not set(saved_columns()) & set(saved)
+    # The replaced entry's columns stay readable by whoever mapped them.
+    assert old_start.tolist() == expected.start_minute.tolist()
+    # No temporary directories are left behind.
+    assert all(not name.startswith('.') for name in os.listdir(cache_dir))
+
+
+def test_station_state_in_group():
+    """
+    A station's capacity, num_bikes, tla and tlu are read from and written to
+    the arrays of its StationGroup.
+    """
+    stations = create_stations('stations.json')
+    station = stations['6023']
+    assert station.group is None
+    station.tla = 30
+    group = group_stations(list(stations.values()))
+    assert station.group is group
+    assert group.num_bikes[station.index] == 18
+    assert group.capacity[station.index] == 39
+
+    assert group.tla[station.index] == 30
+    group.tla += 60
+    assert station.tla == 90
+    station.num_bikes -= 1
+    assert group.num_bikes[station.index] == 17
+    assert station.num_bikes == 17
+
+
+def test_live_statistics():
+    """
+    A simulation with live statistics reports the same statistics as one
+    that computes them at the end, and ranks the top stations in order.
+    """
+    start = datetime(2017, 7, 1, 8, 0, 0)
+    end = datetime(2017, 7, 1, 8, 25, 0)
+    sim = Simulation('stations.json', 'sample_rides.csv', headless=True)
+    sim.run(start, end)
+    live = Simulation('stations.json', 'sample_rides.csv', headless=True,
+                      live_stats=True)
+    live.run(start, end)
+
+    assert live.calculate_statistics() == sim.calculate_statistics()
+    top = live.top_statistics(3)
+    assert top == sim.top_statistics(3)
+    for key, leader in live.calculate_statistics().items():
+        assert top[key][0] == leader
+        assert [value for _, value in top[key]] == \
+            sorted([value for _, value in top[key]], reverse=True)
+
+    # The tla/tlu of the stations that never change during a run reach the
+    # leaderboards at its end, whichever way the run steps through time.
+    later = datetime(2017, 7, 1, 9, 0, 0)
+    for skip_idle in [False, True]:
+        live = Simulation('stations.json', 'sample_rides.csv', headless=True,
+                          live_stats=True)
+        live.run(start, end, skip_idle=skip_idle)
+        live.run(end, later, skip_idle=skip_idle)
+        sim.reset()
+        sim.run(start, end)
+        sim.run(end, later)
+        assert live.calculate_statistics() == sim.calculate_statistics()
+        assert live.top_statistics(5) == sim.top_statistics(5)
+
+
+def test_leaderboard_updates():
+    """
+    A leaderboard ranks its items by their latest values after many updates,
+    including items that go back to an old value.
+    """
+    names = {item: 'station {}'.format(item % 7) for item in range(20)}
+    values = {item: 0 for item in names}
+    board = Leaderboard(names, values)
+    for step in range(500):
+        item = step * 7 % 20
+        values[item] = step * 13 % 11
+        board.update(item, values[item])
+        expected = sorted(names, key=lambda i: (-values[i], names[i], i))
+        assert board.leader() == (names[expected[0]], values[expected[0]])
+        if step % 50 == 0:
+            assert board.top(20) == [(names[i], values[i])
+                                     for i in expected]
+    assert board.top(25) == board.top(20)
+    assert [board.value(item) for item in names] == \
+        [values[item] for item in names]
+
+
+def test_map_sprite_cache(monkeypatch):
+    """
+    Each sprite is loaded once, and scaled versions are only made for zoom
+    levels where sprites are scaled.
+    """
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'  # Ignore this line
+    pygame.init()
+    map_ = Map(SCREEN_SIZE)
+    station = create_stations('stations.json')['6023']
+    loads, scales = [], []
+    load, smoothscale = pygame.image.load, pygame.transform.smoothscale
+    monkeypatch.setattr(pygame.image, 'load',
+                        lambda *args: loads.append(args) or load(*args))
+    monkeypatch.setattr(pygame.transform, 'smoothscale',
+                        lambda *args: scales.append(args) or
+                        smoothscale(*args))
+
+    def render() -> bytes:
+        """Return the pixels of <station> drawn by <map_>."""
+        screen = pygame.Surface(SCREEN_SIZE)
+        map_.render_objects([station], screen, datetime(2017, 6, 1))
+        return pygame.image.tostring(screen, 'RGB')
+
+    plain = render()
+    map_.zoom(0.5)
+    assert render() != plain  # The station moved, with the same sprite.
+    assert len(loads) == 1 and not scales
+
+    map_.scale_sprites = True
+    scaled = render()
+    assert len(scales) == 1
+    assert render() == scaled
+    assert len(loads) == 1 and len(scales) == 1
+
+
+def test_map_view_cache():
+    """
+    The map view is only computed again after a pan or zoom, and the map
+    pyramid halves the image while it is larger than the screen.
+    """
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'  # Ignore this line
+    pygame.init()
+    map_ = Map(SCREEN_SIZE)
+    view = map_.get_current_view()
+    assert view.get_size() == SCREEN_SIZE
+    assert map_.get_current_view() is view
+
+    map_.zoom(0.5)
+    zoomed = map_.get_current_view()
+    assert zoomed is not view
+    assert zoomed.get_size() == SCREEN_SIZE
+    map_.pan((-10, -10))
+    assert map_.get_current_view() is not zoomed
+
+    # The whole map, scaled down from a smaller copy of the image, looks
+    # like the image scaled down to the screen in one step.
+    whole = Map(SCREEN_SIZE)
+    direct = pygame.transform.smoothscale(whole.image, SCREEN_SIZE)
+    difference = np.abs(
+        pygame.surfarray.array3d(whole.get_current_view()).astype(int) -
+        pygame.surfarray.array3d(direct).astype(int))
+    assert difference.mean() < 8
+
+
+def test_batched_ride_positions():
+    """
+    Positions interpolated and projected for many rides at once match those
+    of Ride.get_position and Map._latlong_to_screen.
+    """
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'  # Ignore this line
+    pygame.init()
+    map_ = Map(SCREEN_SIZE)
+    map_.zoom(0.5)
+    stations = create_stations('stations.json')
+    rides = create_rides('sample_rides.csv', stations)
+    drawables = list(stations.values())[:5] + rides
+    for time in [datetime(2017, 6, 1, 8, 0), datetime(2017, 6, 1, 8, 17),
+                 datetime(2017, 6, 1, 9, 0)]:
+        positions = drawable_positions(drawables, time)
+        screen = map_.latlong_to_screen_array(positions).tolist()
+        for drawable, position, pixel in zip(drawables, positions.tolist(),
+                                             screen):
+            assert tuple(position) == drawable.get_position(time)
+            assert tuple(pixel) == map_._latlong_to_screen(position)
+
+    # Rides of more than a day are interpolated as get_position does it.
+    start, end = stations['6023'], stations['6034']
+    ride = Ride(start, end, (datetime(2017, 6, 1, 8, 0),
+                             datetime(2017, 6, 3, 11, 0)))
+    for time in [datetime(2017, 6, 1, 9, 30), datetime(2017, 6, 2, 9, 30),
+                 datetime(2017, 6, 3, 10, 59, 30, 500),
+                 datetime(2017, 6, 4, 0, 0)]:
+        assert tuple(drawable_positions([ride], time)[0].tolist()) == \
+            ride.get_position(time)
+    ride = Ride(start, end, (datetime(2017, 6, 1, 8, 0),
+                             datetime(2017, 6, 3, 8, 0)))
+    with raises(ZeroDivisionError):
+        ride.get_position(datetime(2017, 6, 2, 8, 0))
+    with raises(ZeroDivisionError):
+        drawable_positions([ride], datetime(2017, 6, 2, 8, 0))
+
+
+def test_frame_export(tmpdir, monkeypatch):
+    """
+    An exporting simulation saves one PNG image per rendered minute, with
+    the same statistics as a headless one, and stops its frame writer even
+    if the run fails.
+    """
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'  # Ignore this line
+    frame_dir = os.path.join(str(tmpdir), 'frames')
+    simulation = Simulation('stations.json', 'sample_rides.csv',
+                            frame_dir=frame_dir, frame_workers=2)
+    simulation.run(datetime(2017, 6, 1, 8, 0), datetime(2017, 6, 1, 8, 5))
+    assert sorted(os.listdir(frame_dir)) == \
+        ['frame{:06d}.png'.format(i) for i in range(6)]
+    frame = pygame.image.load(os.path.join(frame_dir, 'frame000005.png'))
+    assert frame.get_size() == SCREEN_SIZE
+
+    headless = Simulation('stations.json', 'sample_rides.csv',
+                          headless=True)
+    headless.run(datetime(2017, 6, 1, 8, 0), datetime(2017, 6, 1, 8, 5))
+    assert simulation.calculate_statistics() == \
+        headless.calculate_statistics()
+    with raises(ValueError):
+        Simulation('stations.json', 'sample_rides.csv', headless=True,
+                   frame_dir=frame_dir)
+
+    closed = []
+    close = FrameWriter.close
+    monkeypatch.setattr(FrameWriter, 'close',
+                        lambda writer: closed.append(close(writer)))
+
+    # The ride read at 8:23 starts before the one read before it.
+    with open('sample_rides.csv') as file:
+        lines = file.readlines()
+    rides_file = os.path.join(str(tmpdir), 'rides.csv')
+    with open(rides_file, 'w') as file:
+        file.writelines([lines[4], lines[3]])
+    failing = Simulation('stations.json', rides_file, streaming=True,
+                         frame_dir=os.path.join(str(tmpdir), 'failed'),
+                         frame_workers=1)
+    with raises(ValueError):
+        failing.run(datetime(2017, 6, 1, 8, 0), datetime(2017, 6, 1, 9, 0))
+    assert len(closed) == 1
+
+
+def test_render_cadence(tmpdir):
+    """
+    Only every render_every-th minute and the last minute are rendered, and
+    the statistics do not depend on the rendering.
+    """
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'  # Ignore this line
+    frame_dir = os.path.join(str(tmpdir), 'frames')
+    simulation = Simulation('stations.json', 'sample_rides.csv',
+                            frame_dir=frame_dir, frame_workers=1)
+    simulation.run(datetime(2017, 6, 1, 8, 0), datetime(2017, 6, 1, 8, 5),
+                   render_every=2)
+    assert len(os.listdir(frame_dir)) == 4  # 8:00, 8:02, 8:04 and 8:05
+
+    # At most one frame every 1000 seconds: only the first and last ones.
+    slow_dir = os.path.join(str(tmpdir), 'slow')
+    slow = Simulation('stations.json', 'sample_rides.csv',
+                      frame_dir=slow_dir, frame_workers=1)
+    slow.run(datetime(2017, 6, 1, 8, 0), datetime(2017, 6, 1, 8, 5),
+             target_fps=0.001)
+    assert len(os.listdir(slow_dir)) == 2
+
+    headless = Simulation('stations.json', 'sample_rides.csv',
+                          headless=True)
+    headless.run(datetime(2017, 6, 1, 8, 0), datetime(2017, 6, 1, 8, 5))
+    assert simulation.calculate_statistics() == \
+        headless.calculate_statistics()
+    with raises(ValueError):
+        headless.run(datetime(2017, 6, 1, 8, 0), datetime(2017, 6, 1, 8, 5),
+                     render_every=0)
+
+
+def test_run_scenarios():
+    """
+    Scenarios run in worker processes give the same statistics as new
+    simulations run one after the other.
+    """
+    windows = [(datetime(2017, 6, 1, 8, 0), datetime(2017, 6, 1, 8, 30)),
+               (datetime(2017, 6, 1, 8, 15), datetime(2017, 6, 1, 9, 0)),
+               (datetime(2017, 6, 1, 7, 0), datetime(2017, 6, 1, 10, 0))]
+    scenarios = [Scenario(start, end) for start, end in windows] + \
+        [Scenario(windows[0][0], windows[0][1], {'6023': (20, 0)}),
+         Scenario(windows[1][0], windows[1][1], skip_idle=False)]
+    results = dict(run_scenarios('stations.json', 'sample_rides.csv',
+                                 scenarios, workers=2))
+    assert sorted(results) == [0, 1, 2, 3, 4]
+
+    for i, scenario in enumerate(scenarios):
+        simulation = Simulation('stations.json', 'sample_rides.csv',
+                                headless=True)
+        for id_, (capacity, num_bikes) in scenario.stations.items():
+            simulation.all_stations[id_].capacity = capacity
+            simulation.all_stations[id_].num_bikes = num_bikes
+        simulation.run(scenario.start, scenario.end)
+        assert results[i] == simulation.calculate_statistics()
+
+
+def test_run_scenarios_closed_early(tmpdir, monkeypatch):
+    """
+    Closing the results after the first one cancels the scenarios that no
+    worker has taken yet, instead of running them all first, and releases
+    the simulation that was loaded for the workers.
+    """
+    record_dir = str(tmpdir)
+    created = []
+    init, run = Simulation.__init__, Simulation.run
+
+    def record_init(simulation: Simulation, *args: object,
+                    **options: object) -> None:
+        """Keep track of <simulation> without keeping it alive."""
+        created.append(weakref.ref(simulation))
+        init(simulation, *args, **options)
+
+    def record_run(simulation: Simulation, start: datetime, end: datetime,
+                   **options: object) -> None:
+        """Record in <record_dir> that a worker ran the scenario from
+        <start>, taking a while like a long run.
+        """
+        with open(os.path.join(record_dir, start.strftime('%H%M')), 'w'):
+            pass
+        sleep(0.2)
+        run(simulation, start, end, **options)
+    monkeypatch.setattr(Simulation, '__init__', record_init)
+    monkeypatch.setattr(Simulation, 'run', record_run)
+
+    scenarios = [Scenario(datetime(2017, 6, 1, hour, 0),
+                          datetime(2017, 6, 1, hour, 30))
+                 for hour in range(12)]
+    results = run_scenarios('stations.json', 'sample_rides.csv', scenarios,
+                            workers=1)
+    next(results)
+    results.close()
+    # The scenarios already handed to the worker may still finish.
+    assert 1 <= len(os.listdir(record_dir)) <= 4
+    gc.collect()
+    assert created and all(ref() is None for ref in created)
+
+
+def test_checkpoint_resume(tmpdir):
+    """
+    A run continued from a checkpoint ends like the run that saved it, and
+    a window resumed from an earlier checkpoint matches one resumed from a
+    checkpoint saved at its start.
+    """
+    start, end = datetime(2017, 6, 1, 0, 0), datetime(2017, 6, 1, 12, 0)
+    hourly, every_minute = str(tmpdir.mkdir('hourly')), \
+        str(tmpdir.mkdir('minute'))
+    full = Simulation('stations.json', 'sample_rides.csv', headless=True)
+    full.run(start, end, skip_idle=True, checkpoint_dir=hourly,
+             checkpoint_every=timedelta(hours=1))
+    assert len(os.listdir(hourly)) == 13  # 0:00 to 12:00
+    Simulation('stations.json', 'sample_rides.csv', headless=True).run(
+        start, end, checkpoint_dir=every_minute,
+        checkpoint_every=timedelta(minutes=1))
+
+    continued = Simulation('stations.json', 'sample_rides.csv',
+                           headless=True)
+    time = continued.load_checkpoint(
+        os.path.join(hourly, 'checkpoint-2017-06-01-0800.npz'))
+    assert time == datetime(2017, 6, 1, 8, 0)
+    continued.run(time, end)
+    assert continued.calculate_statistics() == full.calculate_statistics()
+
+    window = (datetime(2017, 6, 1, 8, 17), datetime(2017, 6, 1, 9, 30))
+    results = []
+    for checkpoint_dir in [hourly, every_minute]:
+        simulation = Simulation('stations.json', 'sample_rides.csv',
+                                headless=True)
+        simulation.resume(checkpoint_dir, window[0], window[1])
+        results.append([(s.num_bikes, s.start, s.end, s.tla, s.tlu)
+                        for s in simulation.all_stations.values()])
+    assert results[0] == results[1]
+    with raises(ValueError):
+        simulation.resume(hourly, datetime(2017, 5, 31), window[1])
+    with raises(ValueError):
+        simulation.run(start, end, checkpoint_dir=hourly,
+                       checkpoint_every=timedelta(0))
+
+    # A checkpoint only fits a simulation of the same rides.
+    ride_file = os.path.join(str(tmpdir), 'rides.csv')
+    with open('sample_rides.csv') as file:
+        lines = file.readlines()
+    with open(ride_file, 'w') as file:
+        file.writelines(lines[:-1])
+    other = Simulation('stations.json', ride_file, headless=True)
+    with raises(ValueError):
+        other.load_checkpoint(
+            os.path.join(hourly, 'checkpoint-2017-06-01-0800.npz'))
+
+
+def test_benchmark_generator(tmpdir):
+    """
+    The generated files have the requested numbers of stations and rides,
+    and the same seed gives the same files.
+    """
+    station_file = os.path.join(str(tmpdir), 'stations.json')
+    ride_file = os.path.join(str(tmpdir), 'rides.csv')
+    station_ids = generate_stations(station_file, 50, 1)
+    generate_rides(ride_file, station_ids, 500, 1)
+    stations = create_stations(station_file)
+    rides = create_rides(ride_file, stations)
+    assert list(stations) == station_ids
+    assert len(rides) == 500
+    assert [ride.start_time for ride in rides] == \
+        sorted(ride.start_time for ride in rides)
+
+    with open(ride_file) as file:
+        first = file.read()
+    generate_rides(ride_file, station_ids, 500, 1)
+    with open(ride_file) as file:
+        assert file.read() == first
+
+    # The one-off build of the ride index is timed apart from the runs.
+    timings = benchmark(20, 200, 1, frames=0)
+    assert timings['ride_index'] > 0
+    assert 'render' not in timings
+
+
+def test_instrumented_simulation():
+    """
+    An instrumented simulation gives the same statistics, and counts every
+    ride start and end it processes.
+    """
+    start, end = datetime(2017, 6, 1, 7, 0), datetime(2017, 6, 1, 10, 0)
+    plain = Simulation('stations.json', 'sample_rides.csv', headless=True)
+    plain.run(start, end)
+    assert plain.instruments is None
+    simulation = Simulation('stations.json', 'sample_rides.csv',
+                            headless=True, instrument=True)
+    simulation.run(start, end, skip_idle=True)
+    assert simulation.calculate_statistics() == plain.calculate_statistics()
+
+    report = simulation.instruments.report()
+    counters = report['counters']
+    counted = sum(s.start + s.end for s in simulation.all_stations.values())
+    assert counters['events'] == \
+        counted + counters['ignored_starts'] + counters['ignored_ends']
+    assert counters['frames'] == 0
+    assert counters['queue_high_water'] > 0
+    assert report['timers']['ingestion'] > 0
+    assert report['timers']['total'] == approx(
+        sum(report['timers'][phase] for phase in
+            ['ingestion', 'events', 'statistics', 'rendering']))
+    assert report['timers']['statistics'] > 0
+
+    # The time of a timed call made during another one only counts in the
+    # phase of the inner call.
+    instruments = Instruments()
+    crediting = instruments.timed('statistics', sleep)
+    instruments.timed('events', crediting)(0.05)
+    assert instruments.timers['statistics'] >= 0.05
+    assert instruments.timers['events'] < 0.05
+
+
+def test_queue_high_water(tmpdir):
+    """
+    The queue high water mark counts the events and minutes that are pending
+    at the busiest moment of a run, even within a minute, and is not counted
+    by runs that do not process their rides from queues.
+    """
+    ride_file = os.path.join(str(tmpdir), 'rides.csv')
+    with open(ride_file, 'w') as file:
+        file.write('2017-06-01 07:50,6134,2017-06-01 08:00,6721,600,1\n'
+                   '2017-06-01 08:00,6258,2017-06-01 08:10,6034,600,1\n'
+                   '2017-06-01 08:00,6134,2017-06-01 08:20,6721,1200,1\n')
+    start, end = datetime(2017, 6, 1, 8, 0), datetime(2017, 6, 1, 8, 30)
+    for options, skip_idle, expected in [
+            ({}, False, 0),
+            # One end event and two start events, all loaded at the start.
+            ({}, True, 3),
+            # The end event is loaded; the start events are read at 8:00,
+            # before any event of 8:00 is processed.
+            ({'streaming': True}, False, 3),
+            # The start minute and the end minute of the active ride.
+            ({'columnar': True}, False, 2)]:
+        simulation = Simulation('stations.json', ride_file, headless=True,
+                                instrument=True, **options)
+        simulation.run(start, end, skip_idle=skip_idle)
+        assert simulation.instruments.report()['counters'][
+            'queue_high_water'] == expected
+
+
+def test_slotted_objects_and_lazy_end_events():
+    """
+    Stations, rides and events have no per-object dictionary, and a ride
+    end event is only created when its ride starts.
+    """
+    simulation = Simulation('stations.json', 'sample_rides.csv',
+                            headless=True)
+    ride = simulation.all_rides[0]
+    for obj in [ride, ride.start, RideStartEvent(simulation, ride.start_time,
+                                                 ride)]:
+        assert not hasattr(obj, '__dict__')
+    assert ride.sprite == 'bikesprite.png'
+    assert ride.start.sprite == 'stationsprite.png'
+
+    class Marker(Drawable):
+        """A drawable that stores its own sprite."""
+        __slots__ = ()
+
+    marker = Marker('stationsprite.png')
+    assert marker.sprite == 'stationsprite.png'
+    assert not hasattr(marker, '__dict__')
+
+    ride.start.num_bikes = 0
+    assert RideStartEvent(simulation, ride.start_time, ride).process() == []
+    assert simulation.priorityqueue.is_empty()
+    ride.start.num_bikes = 1
+    end_events = RideStartEvent(simulation, ride.start_time, ride).process()
+    assert len(end_events) == 1 and end_events[0].time == ride.end_time
+    assert simulation.priorityqueue.peek() is end_events[0]
+
+
+def test_lazy_station_accounting():
+    """
+    Crediting tla/tlu only when a station changes gives every station the
+    same totals as crediting every station at every minute.
+    """
+    start = datetime(2017, 6, 1, 7, 0, 0)
+    end = datetime(2017, 6, 1, 10, 0, 0)
+    totals = []
+    for live_stats in [False, True]:
+        sim = Simulation('stations.json', 'sample_rides.csv', headless=True,
+                         live_stats=live_stats)
+        sim.run(start, end, skip_idle=True)
+        totals.append([(s.tla, s.tlu) for s in sim.all_stations.values()])
+    assert totals[0] == totals[1]
+    assert any(tla for tla, _ in totals[0])
+
+
+def test_occupancy_history():
+    """
+    The recorded occupancy of each station agrees with its statistics and
+    final number of bikes, and range queries combine its changes.
+    """
+    start = datetime(2017, 6, 1, 7, 0, 0)
+    end = datetime(2017, 6, 1, 10, 0, 0)
+    sim = Simulation('stations.json', 'sample_rides.csv', headless=True,
+                     record_occupancy=True)
+    sim.run(start, end, skip_idle=True)
+    history = sim.occupancy
+    for id_, station in sim.all_stations.items():
+        assert history.time_below(id_, 6, start,
+                                  end - timedelta(minutes=1)) == station.tla
+        assert history.num_bikes(id_, end) == station.num_bikes
+    with raises(ValueError):
+        history.mean('6023', start - timedelta(minutes=1), end)
+
+    history = OccupancyHistory(['a'], [3], 0)
+    history.record(0, 10, 2)
+    history.record(0, 10, 3)  # Back to 3 within the same minute.
+    history.record(0, 20, 1)
+    history.finish(29)
+    assert history.changes('a') == [(datetime(1970, 1, 1, 0, 0), 3),
+                                    (datetime(1970, 1, 1, 0, 20), 1)]
+    first, last = datetime(1970, 1, 1, 0, 15), datetime(1970, 1, 1, 0, 24)
+    assert history.minimum('a', first, last) == 1
+    assert history.mean('a', first, last) == approx(2.0)
+    assert history.time_below('a', 2, first, last) == 5 * 60
+
+
+def test_ride_index_matches_scan():
+    """
+    The rides found in a RideIndex are the rides found by looking at every
+    ride, in the same order, even with a ride lasting several days, and a
+    simulation's index is rebuilt when its rides are changed in place.
+    """
+    stations = create_stations('stations.json')
+    table = create_ride_table('sample_rides.csv', stations)
+    index = RideIndex(table.start_minute, table.end_minute)
+    starts, ends = table.start_minute.tolist(), table.end_minute.tolist()
+    for minute in range(min(starts) - 5, max(ends) + 5, 7):
+        assert index.starting(minute, minute + 30).tolist() == \
+            [i for i, start in enumerate(starts)
+             if minute <= start <= minute + 30]
+        assert index.straddling(minute).tolist() == \
+            [i for i, (start, end) in enumerate(zip(starts, ends))
+             if start < minute <= end]
+
+    starts.append(min(starts) - 3 * 24 * 60)
+    ends.append(max(ends) + 1)
+    index = RideIndex(np.array(starts), np.array(ends))
+    for minute in range(min(starts) - 5, max(ends) + 5, 97):
+        assert index.straddling(minute).tolist() == \
+            [i for i, (start, end) in enumerate(zip(starts, ends))
+             if start < minute <= end]
+
+    simulation = Simulation('stations.json', 'sample_rides.csv',
+                            headless=True)
+    time = datetime(2017, 6, 1, 8, 10)
+    simulation.run(time, time)
+    assert len(simulation.active_rides) > 0
+    # The same number of rides, all a day earlier.
+    day = timedelta(days=1)
+    simulation.all_rides[:] = [
+        Ride(ride.start, ride.end,
+             (ride.start_time - day, ride.end_time - day))
+        for ride in simulation.all_rides]
+    simulation.rides_changed()
+    simulation.reset()
+    simulation.run(time, time)
+    assert simulation.active_rides == []
+
+
+def test_station_culling():
+    """
+    The spatial grid finds exactly the points in a box, and the map draws
+    the same frame as if it drew every station and ride, although some of
+    them are out of view.
+    """
+    stations = list(create_stations('stations.json').values())
+    grid = SpatialGrid([station.location for station in stations])
+    low, high = (-73.6, 45.5), (-73.55, 45.52)
+    assert grid.query(low, high).tolist() == \
+        [i for i, (long, lat) in enumerate(grid.points.tolist())
+         if low[0] <= long <= high[0] and low[1] <= lat <= high[1]]
+
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'  # Ignore this line
+    pygame.init()
+    map_ = Map(SCREEN_SIZE)
+    map_.set_stations(stations)
+    map_.cluster_stations = False
+    map_.zoom(3)
+    map_.pan((-1000, -1000))
+
+    def draw_all(drawables: list, locations: np.ndarray) -> bytes:
+        """Return the pixels of every sprite of <drawables> drawn at the
+        screen positions of <locations>.
+        """
+        screen = pygame.Surface(SCREEN_SIZE)
+        positions = map_.latlong_to_screen_array(locations).tolist()
+        for drawable, position in zip(drawables, positions):
+            sprite = pygame.image.load(drawable.sprite)
+            if pygame.display.get_surface() is not None:
+                sprite = sprite.convert_alpha()
+            screen.blit(sprite, position)
+        return pygame.image.tostring(screen, 'RGB')
+
+    def on_screen(positions: np.ndarray) -> np.ndarray:
+        """Return whether each of the screen <positions> is on the screen.
+        """
+        return (positions[:, 0] >= 0) & (positions[:, 0] < SCREEN_SIZE[0]) & \
+            (positions[:, 1] >= 0) & (positions[:, 1] < SCREEN_SIZE[1])
+
+    visible = on_screen(map_.latlong_to_screen_array(grid.points))
+    assert 0 < visible.sum() < len(stations)
+    screen = pygame.Surface(SCREEN_SIZE)
+    map_.render_stations(screen)
+    assert pygame.image.tostring(screen, 'RGB') == \
+        draw_all(stations, grid.points)
+
+    time = datetime(2017, 6, 1, 8, 0)
+    trip = (time - timedelta(minutes=5), time + timedelta(minutes=5))
+    rides = [Ride(stations[i], stations[i * step % len(stations)], trip)
+             for i in range(1, len(stations)) for step in [37, 101]]
+    for pan in [(0, 0), (700, 700), (-400, 300)]:
+        map_.pan(pan)
+        # Some rides are out of view from their start to their end.
+        starts = map_.latlong_to_screen_array(
+            np.array([ride.start.location for ride in rides]))
+        ends = map_.latlong_to_screen_array(
+            np.array([ride.end.location for ride in rides]))
+        out_of_view = (np.maximum(starts, ends) < 0).any(axis=1) | \
+            (np.minimum(starts, ends) >= SCREEN_SIZE).any(axis=1)
+        assert 0 < out_of_view.sum() < len(rides)
+        for now in [trip[0], time, trip[1]]:
+            screen = pygame.Surface(SCREEN_SIZE)
+            map_.render_objects(rides, screen, now)
+            assert pygame.image.tostring(screen, 'RGB') == \
+                draw_all(rides, drawable_positions(rides, now))
+
+
+def test_station_clusters():
+    """
+    Below CLUSTER_MAX_ZOOM, fewer markers than stations are drawn, the
+    markers of clusters grow with their bikes, and a cluster of one station
+    is drawn as the station. From CLUSTER_MAX_ZOOM on, every station is
+    drawn on its own.
+    """
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'  # Ignore this line
+    pygame.init()
+    stations = list(create_stations('stations.json').values())
+    map_ = Map(SCREEN_SIZE)
+    map_.set_stations(stations)
+
+    class CountingSurface(pygame.Surface):
+        """A surface that counts the sprites drawn onto it."""
+        blits = 0
+
+        def blit(self, *args: object) -> pygame.Rect:
+            self.blits += 1
+            return pygame.Surface.blit(self, *args)
+
+    def render(map_: Map, cluster: bool) -> tuple:
+        """Return the pixels of the stations of <map_> and the number of
+        sprites drawn.
+        """
+        screen = CountingSurface(SCREEN_SIZE)
+        map_.cluster_stations = cluster
+        map_.render_stations(screen)
+        return pygame.image.tostring(screen, 'RGB'), screen.blits
+
+    # Zooming is additive, from a zoom of 1.
+    for zoom in [0, CLUSTER_MAX_ZOOM - 1.5]:
+        map_.zoom(zoom)
+        clustered, markers = render(map_, True)
+        individual, drawn = render(map_, False)
+        assert 0 < markers < drawn <= len(stations)
+        assert clustered != individual
+
+    map_.size_clusters = False
+    unsized, plain_markers = render(map_, True)
+    assert plain_markers == markers
+    assert unsized != clustered
+    map_.size_clusters = True
+
+    single = Map(SCREEN_SIZE)
+    single.set_stations(stations[:1])
+    single.zoom(CLUSTER_MAX_ZOOM - 1.5)
+    assert render(single, True) == render(single, False)
+
+    map_.zoom(0.5)
+    assert render(map_, True) == render(map_, False)
+
+
 if __name__ == '__main__':
     import pytest
 
@@ -0,0 +1,267 @@
+"""Assignment 1 - Benchmarks
+
+=== CSC148 Fall 2017 ===
+Diane Horton and David Liu
+Department of Computer Science,
+University of Toronto
+
+
+=== Module Description ===
+
+This file contains a benchmark suite for the simulation. It generates
+synthetic stations and rides files of any size from a random seed, and
+times each phase of the simulation on them separately:
+    - create_stations, create_rides and create_ride_table
+    - building the ride index that the runs select their rides from
+    - the ride updates of a run, minute by minute, with both
+      _update_active_rides and _update_active_rides_fast
+    - the tla/tlu accounting of a run, one station at a time as bikes are
+      taken and returned, and of every station at the end
+    - taking and returning bikes, as every ride start and end event does
+    - rendering frames of all the stations and active rides off-screen
+
+Run it from the command line, for example:
+
+    python benchmark.py --stations 100 1000 --rides 1000 100000
+
+The timings are printed, or written to the file given by --output, as JSON
+so that they can be compared from one version of the code to the next.
+"""
+import argparse
+import csv
+from datetime import datetime, timedelta
+import json
+import os
+import platform
+import random
+import tempfile
+from time import perf_counter
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from bikeshare import Drawable
+from ridestore import DATETIME_FORMAT, create_ride_table, to_minute
+from simulation import Simulation, create_rides, create_stations
+from visualizer import MAP_MAX, MAP_MIN, Visualizer
+
+# Start of the simulation time period of every benchmark.
+BENCHMARK_START = datetime(2017, 6, 1)
+
+
+def generate_stations(path: str, count: int, seed: int) -> List[str]:
+    """Write a stations JSON file with <count> random stations to <path>,
+    in the format of the assignment handout, and return their ids.
+
+    The stations are spread uniformly over the map. The same <seed> always
+    gives the same file.
+    """
+    rng = random.Random(seed)
+    stations = []
+    for i in range(count):
+        capacity = rng.randint(10, 40)
+        bikes = rng.randint(0, capacity)
+        stations.append({
+            'n': str(6000 + i),
+            's': 'Station {}'.format(6000 + i),
+            'la': rng.uniform(MAP_MAX[1], MAP_MIN[1]),
+            'lo': rng.uniform(MAP_MIN[0], MAP_MAX[0]),
+            'da': bikes,
+            'ba': capacity - bikes
+        })
+    with open(path, 'w') as file:
+        json.dump({'stations': stations}, file)
+    return [station['n'] for station in stations]
+
+
+def generate_rides(path: str, station_ids: List[str], count: int,
+                   seed: int, period: timedelta = timedelta(days=1)) -> None:
+    """Write a rides CSV file with <count> random rides between the stations
+    in <station_ids> to <path>, in the format of the assignment handout.
+
+    The rides start at uniformly random minutes of <period> from
+    BENCHMARK_START, last from 2 to 60 minutes, and are listed in order of
+    start time. The same <seed> always gives the same file.
+    """
+    rng = random.Random(seed)
+    minutes = period // timedelta(minutes=1)
+    starts = sorted(rng.randrange(minutes) for _ in range(count))
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        for start_minute in starts:
+            duration = rng.randint(2, 60)
+            start = BENCHMARK_START + timedelta(minutes=start_minute)
+            end = start + timedelta(minutes=duration)
+            writer.writerow([start.strftime(DATETIME_FORMAT),
+                             rng.choice(station_ids),
+                             end.strftime(DATETIME_FORMAT),
+                             rng.choice(station_ids),
+                             duration * 60, rng.randint(0, 1)])
+
+
+def _timed(function: Callable[[], object]) -> float:
+    """Call <function> and return how long it took, in seconds.
+    """
+    start = perf_counter()
+    function()
+    return perf_counter() - start
+
+
+def _update_every_minute(simulation: Simulation, start: datetime,
+                         end: datetime, skip_idle: bool) -> None:
+    """Process the rides of <simulation> for every minute from <start> to
+    <end>, without the tla/tlu accounting of a run.
+    """
+    update = simulation._prepare_run(start, end, skip_idle)
+    step = timedelta(minutes=1)
+    time = start
+    while time <= end:
+        update(time)
+        time += step
+
+
+def _credit_stations(simulation: Simulation, start: datetime,
+                     end: datetime, rounds: int) -> None:
+    """Do the tla/tlu accounting of a run of <simulation> from <start> to
+    <end>, without processing any ride.
+
+    Every station is credited on its own <rounds> times, at evenly spread
+    minutes, as it is before each change of its number of bikes, and then
+    all the stations are credited at once at <end>.
+    """
+    first, last = to_minute(start), to_minute(end)
+    simulation._credited = np.full(len(simulation.all_stations), first,
+                                   dtype=np.int64)
+    indices = range(len(simulation.all_stations))
+    for i in range(rounds):
+        simulation._now = first + (last - first) * (i + 1) // (rounds + 1)
+        for index in indices:
+            simulation._credit_station(index)
+    simulation._credit_stations(last)
+    simulation._credited = None
+
+
+def _take_and_return(simulation: Simulation, rounds: int) -> None:
+    """Take a bike from and return a bike to every station of <simulation>,
+    <rounds> times, as ride start and end events do.
+    """
+    stations = list(simulation.all_stations.values())
+    for _ in range(rounds):
+        for station in stations:
+            simulation.take_bike(station)
+            simulation.return_bike(station)
+
+
+def _render_frames(visualizer: Visualizer, drawables: List[Drawable],
+                   time: datetime, frames: int) -> None:
+    """Render <frames> frames of <drawables> at <time> with <visualizer>,
+    whose stations have already been set.
+    """
+    for _ in range(frames):
+        visualizer.render_drawables(drawables, time)
+
+
+def benchmark(stations: int, rides: int, seed: int,
+              period: timedelta = timedelta(days=1),
+              frames: int = 10) -> Dict[str, float]:
+    """Return how long each phase of the simulation takes, in seconds, on
+    generated files of <stations> stations and <rides> rides over <period>.
+
+    <frames> frames are rendered, at the middle of <period>. No frame is
+    rendered if <frames> is 0.
+    """
+    start, end = BENCHMARK_START, BENCHMARK_START + period
+    timings = {}
+    with tempfile.TemporaryDirectory() as directory:
+        station_file = os.path.join(directory, 'stations.json')
+        ride_file = os.path.join(directory, 'rides.csv')
+        station_ids = generate_stations(station_file, stations, seed)
+        generate_rides(ride_file, station_ids, rides, seed, period)
+
+        timings['create_stations'] = _timed(
+            lambda: create_stations(station_file))
+        loaded = create_stations(station_file)
+        timings['create_rides'] = _timed(
+            lambda: create_rides(ride_file, loaded))
+        timings['create_ride_table'] = _timed(
+            lambda: create_ride_table(ride_file, loaded))
+
+        simulation = Simulation(station_file, ride_file, headless=True)
+        # The ride index is built once, by the first run that needs it.
+        timings['ride_index'] = _timed(simulation._get_ride_index)
+        for name, skip_idle in [('update_active_rides', False),
+                                ('update_active_rides_fast', True)]:
+            simulation.reset()
+            timings[name] = _timed(lambda: _update_every_minute(
+                simulation, start, end, skip_idle))
+        # About as many events as the rides of a run have.
+        rounds = max(1, rides // max(1, stations))
+        simulation.reset()
+        timings['statistics'] = _timed(
+            lambda: _credit_stations(simulation, start, end, 2 * rounds))
+        simulation.reset()
+        timings['take_and_return'] = _timed(
+            lambda: _take_and_return(simulation, rounds))
+        simulation.reset()
+        timings['run'] = _timed(lambda: simulation.run(start, end))
+        simulation.reset()
+        timings['run_skip_idle'] = _timed(
+            lambda: simulation.run(start, end, skip_idle=True))
+
+        if frames:
+            middle = start + period / 2
+            simulation.reset()
+            simulation.run(start, middle, skip_idle=True)
+            visualizer = Visualizer(offscreen=True)
+            visualizer.set_stations(list(simulation.all_stations.values()))
+            drawables = simulation._active_drawables()
+            timings['render'] = _timed(
+                lambda: _render_frames(visualizer, drawables, middle,
+                                       frames))
+    return timings
+
+
+def main(arguments: Optional[List[str]] = None) -> None:
+    """Run the benchmarks for the command line <arguments>, and print or
+    save the results as JSON.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--stations', type=int, nargs='+', default=[100],
+                        help='numbers of stations to generate')
+    parser.add_argument('--rides', type=int, nargs='+', default=[1000],
+                        help='numbers of rides to generate')
+    parser.add_argument('--seed', type=int, default=148,
+                        help='seed of the random generator')
+    parser.add_argument('--days', type=float, default=1,
+                        help='length of the simulation time period')
+    parser.add_argument('--frames', type=int, default=10,
+                        help='number of frames to render, or 0')
+    parser.add_argument('--output', help='file to write the results to')
+    options = parser.parse_args(arguments)
+
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    results = []
+    for stations in options.stations:
+        for rides in options.rides:
+            timings = benchmark(stations, rides, options.seed,
+                                timedelta(days=options.days),
+                                options.frames)
+            results.append({'stations': stations, 'rides': rides,
+                            'timings': timings})
+    report = {
+        'seed': options.seed,
+        'days': options.days,
+        'frames': options.frames,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results
+    }
+    if options.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(options.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,26 +11,39 @@ University of Toronto
 This file contains the Station and Ride classes, which store the data for the
 objects in this simulation.
 
+The state of a station that changes while the simulation runs is stored in
+the NumPy arrays of a StationGroup, so that it can be updated for all the
+stations of a simulation at once.
+
 There is also an abstract Drawable class that is the superclass for both
 Station and Ride. It enables the simulation to visualize these objects in
-a graphical window.
+a graphical window. The positions of many drawables can be computed at once
+with drawable_positions, which interpolates all the rides together.
 """
 from datetime import datetime
-from typing import Tuple
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
 
 
 # Sprite files
 STATION_SPRITE = 'stationsprite.png'
 RIDE_SPRITE = 'bikesprite.png'
+SECONDS_PER_DAY = 24 * 60 * 60
 
 
 class Drawable:
     """A base class for objects that the graphical renderer can be drawn.
 
+    Subclasses that draw every object with the same image, like Station and
+    Ride, set sprite as a class attribute instead of calling __init__, which
+    hides the slot that __init__ would store it in.
+
     === Public Attributes ===
     sprite:
         The filename of the image to be drawn for this object.
     """
+    __slots__ = ('sprite',)
     sprite: str
 
     def __init__(self, sprite_file: str) -> None:
@@ -44,6 +57,56 @@ class Drawable:
         raise NotImplementedError
 
 
+class StationGroup:
+    """The state of a group of stations, stored in NumPy arrays.
+
+    Entry i of each array belongs to the station whose index in this group
+    is i.
+
+    === Attributes ===
+    capacity:
+        The capacity of each station.
+    num_bikes:
+        The current number of bikes at each station.
+    tla:
+        The total low availability time of each station, in seconds.
+    tlu:
+        The total low unoccupied time of each station, in seconds.
+
+    === Representation Invariants ===
+    - all arrays have the same length
+    """
+    capacity: np.ndarray
+    num_bikes: np.ndarray
+    tla: np.ndarray
+    tlu: np.ndarray
+
+    def __init__(self, capacity: List[int], num_bikes: List[int],
+                 tla: List[int], tlu: List[int]) -> None:
+        """Initialize a group of stations with the given state.
+        """
+        self.capacity = np.array(capacity, dtype=np.int64)
+        self.num_bikes = np.array(num_bikes, dtype=np.int64)
+        self.tla = np.array(tla, dtype=np.int64)
+        self.tlu = np.array(tlu, dtype=np.int64)
+
+
+def group_stations(stations: List['Station']) -> StationGroup:
+    """Return a new StationGroup holding the current state of <stations>.
+
+    From now on, stations[i] reads and writes its state at index i of the
+    returned group.
+    """
+    group = StationGroup([s.capacity for s in stations],
+                         [s.num_bikes for s in stations],
+                         [s.tla for s in stations],
+                         [s.tlu for s in stations])
+    for i, station in enumerate(stations):
+        station.group, station.index = group, i
+        station._state = None
+    return group
+
+
 class Station(Drawable):
     """A Bixi station.
 
@@ -68,29 +131,102 @@ class Station(Drawable):
         Stands for 'Total Low Unoccupied'.
         Total amount of time during the simulation, in seconds,
         that the station spent with at most five unoccupied spots.
+    group:
+        The StationGroup where capacity, num_bikes, tla and tlu are stored,
+        or None if the station has not been grouped by group_stations yet.
+    index:
+        The index of this station in group.
+
+    === Private Attributes ===
+    _state:
+        The capacity, num_bikes, tla and tlu of the station while group is
+        None, and None afterwards.
 
     === Representation Invariants ===
     - 0 <= num_bikes <= capacity
+    - exactly one of group and _state is None
     """
+    __slots__ = ('name', 'location', 'start', 'end', 'group', 'index',
+                 '_state')
+    sprite = STATION_SPRITE
     name: str
     location: Tuple[float, float]
-    capacity: int
-    num_bikes: int
     start: int
     end: int
-    tla: int  # time_low_availability
-    tlu: int  # time_low_unoccupied
+    group: Optional[StationGroup]
+    index: int
+    _state: Optional[List[int]]
 
     def __init__(self, pos: Tuple[float, float], cap: int,
                  num_bikes: int, name: str) -> None:
         """Initialize a new station.
         """
-        Drawable.__init__(self, STATION_SPRITE)
         self.location = pos
-        self.capacity = cap
-        self.num_bikes = num_bikes
+        self.group = None
+        self.index = 0
+        self._state = [cap, num_bikes, 0, 0]
         self.name = name
-        self.start = self.end = self.tla = self.tlu = 0
+        self.start = self.end = 0
+
+    @property
+    def capacity(self) -> int:
+        """The total number of bikes the station can store.
+        """
+        if self._state is not None:
+            return self._state[0]
+        return self.group.capacity.item(self.index)
+
+    @capacity.setter
+    def capacity(self, value: int) -> None:
+        if self._state is not None:
+            self._state[0] = value
+        else:
+            self.group.capacity[self.index] = value
+
+    @property
+    def num_bikes(self) -> int:
+        """Current number of bikes at the station.
+        """
+        if self._state is not None:
+            return self._state[1]
+        return self.group.num_bikes.item(self.index)
+
+    @num_bikes.setter
+    def num_bikes(self, value: int) -> None:
+        if self._state is not None:
+            self._state[1] = value
+        else:
+            self.group.num_bikes[self.index] = value
+
+    @property
+    def tla(self) -> int:
+        """Total low availability time, in seconds.
+        """
+        if self._state is not None:
+            return self._state[2]
+        return self.group.tla.item(self.index)
+
+    @tla.setter
+    def tla(self, value: int) -> None:
+        if self._state is not None:
+            self._state[2] = value
+        else:
+            self.group.tla[self.index] = value
+
+    @property
+    def tlu(self) -> int:
+        """Total low unoccupied time, in seconds.
+        """
+        if self._state is not None:
+            return self._state[3]
+        return self.group.tlu.item(self.index)
+
+    @tlu.setter
+    def tlu(self, value: int) -> None:
+        if self._state is not None:
+            self._state[3] = value
+        else:
+            self.group.tlu[self.index] = value
 
     def get_position(self, time: datetime) -> Tuple[float, float]:
         """Return the (long, lat) position of this station for the given time.
@@ -119,6 +255,8 @@ class Ride(Drawable):
     === Representation Invariants ===
     - start_time < end_time
     """
+    __slots__ = ('start', 'end', 'start_time', 'end_time')
+    sprite = RIDE_SPRITE
     start: Station
     end: Station
     start_time: datetime
@@ -128,8 +266,6 @@ class Ride(Drawable):
                  times: Tuple[datetime, datetime]) -> None:
         """Initialize a ride object with the given start and end information.
         """
-        Drawable.__init__(self, RIDE_SPRITE)
-
         self.start, self.end = start, end
         self.start_time, self.end_time = times[0], times[1]
 
@@ -161,12 +297,67 @@ class Ride(Drawable):
             return (long, lat)
 
 
+def ride_positions(rides: Sequence[Ride], time: datetime) -> np.ndarray:
+    """Return the (long, lat) position of each ride in <rides> at the given
+    time, as the rows of an array with two columns.
+
+    The positions are the same as those returned by Ride.get_position, but
+    they are interpolated for all the rides together. Like get_position,
+    the fraction of a ride that is done only counts whole seconds, and
+    leaves out the whole days of rides that last longer than a day. It
+    raises ZeroDivisionError for the same rides too: those that last a
+    whole number of days.
+    """
+    start = np.array([ride.start.get_position(time) for ride in rides],
+                     dtype=np.float64).reshape(-1, 2)
+    end = np.array([ride.end.get_position(time) for ride in rides],
+                   dtype=np.float64).reshape(-1, 2)
+    start_time = np.array([ride.start_time for ride in rides],
+                          dtype='datetime64[us]')
+    end_time = np.array([ride.end_time for ride in rides],
+                        dtype='datetime64[us]')
+    now = np.datetime64(time, 'us')
+
+    # timedelta.seconds, as get_position takes them.
+    second = np.timedelta64(1, 's')
+    elapsed = (now - start_time) // second % SECONDS_PER_DAY
+    total = (end_time - start_time) // second % SECONDS_PER_DAY
+    if np.any(total == 0):
+        raise ZeroDivisionError('a ride lasts a whole number of days')
+    factor = (elapsed / total)[:, np.newaxis]
+    positions = start + factor * (end - start)
+
+    positions[now <= start_time] = start[now <= start_time]
+    positions[now >= end_time] = end[now >= end_time]
+    return positions
+
+
+def drawable_positions(drawables: Sequence[Drawable],
+                       time: datetime) -> np.ndarray:
+    """Return the (long, lat) position of each object in <drawables> at the
+    given time, as the rows of an array with two columns.
+
+    The positions of all the rides are computed together by ride_positions.
+    """
+    positions = np.empty((len(drawables), 2), dtype=np.float64)
+    rides = []
+    for i, drawable in enumerate(drawables):
+        if isinstance(drawable, Ride):
+            rides.append(i)
+        else:
+            positions[i] = drawable.get_position(time)
+    if rides:
+        positions[rides] = ride_positions([drawables[i] for i in rides],
+                                          time)
+    return positions
+
+
 if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
         'allowed-import-modules': [
             'doctest', 'python_ta', 'typing',
-            'datetime'
+            'datetime', 'numpy'
         ],
         'max-attributes': 15
     })
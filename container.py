@@ -10,10 +10,12 @@ University of Toronto
 
 This module contains the Container and PriorityQueue classes.
 
-Your only task here is to implement the add method for PriorityQueue,
-according to its docstring.
+PriorityQueue is backed by a binary heap, so adding and removing an item
+both take O(log n) time.
 """
-from typing import Generic, List, TypeVar, Optional
+import heapq
+from typing import Callable, Generic, Iterable, List, Optional, Tuple, \
+    TypeVar
 
 # Ignore this line; it is only used to facilitate PyCharm's typechecking.
 T = TypeVar('T')
@@ -47,6 +49,8 @@ class PriorityQueue(Container[T]):
     Items are removed from the queue according to priority; the item with the
     smallest priority is removed first. In this basic implementation, each
     item's value is its priority, and we compare values simply with '<'.
+    A queue can be given a key function instead, and then the priority of
+    each item is its key.
 
     Ties are resolved in first-in-first-out (FIFO) order, meaning the item
     that was inserted *earlier* is the first one to be removed.
@@ -54,39 +58,77 @@ class PriorityQueue(Container[T]):
     All objects in the container must be of the same type.
 
     === Private Attributes ===
-    _queue: List
-      The end of the list represents the *front* of the queue, that is,
-      the next item to be removed.
+    _heap: List[Tuple[object, int, T]]
+      A binary min-heap of (priority, order, item) tuples, as maintained by
+      the heapq module, where order is the number of items added before
+      item. The tuples are compared by the heapq module without calling
+      any Python method, as long as the priorities are built-in values.
+      _heap[0] is the *front* of the queue, that is, the next item to be
+      removed.
+    _counter: int
+      The number of items that have ever been added to this queue. It is
+      used to tag each new entry so that ties are removed in FIFO order.
+    _key: Optional[Callable[[T], object]]
+      The function that gives the priority of an item, or None if each item
+      is its own priority.
 
     === Representation Invariants ===
-    - all elements of _queue are of the same type
-    - the elements of _queue are in non-increasing order
+    - all items in _heap are of the same type
+    - _heap satisfies the heap invariant of the heapq module
+    - the order of every entry in _heap is unique and less than _counter
+    - equal priorities compare equal with '=='
     """
-    _queue: List[T]
+    _heap: List[Tuple[object, int, T]]
+    _counter: int
+    _key: Optional[Callable[[T], object]]
 
-    def __init__(self) -> None:
+    def __init__(self, key: Optional[Callable[[T], object]] = None) -> None:
         """Initialize this to an empty PriorityQueue.
+
+        If <key> is not None, the priority of each item is key(item) rather
+        than the item itself.
+
+        >>> pq = PriorityQueue(key=len)
+        >>> pq.add_many(['fred', 'arju', 'hat'])
+        >>> [pq.remove() for _ in range(3)]
+        ['hat', 'fred', 'arju']
         """
-        self._queue = []
+        self._heap = []
+        self._counter = 0
+        self._key = key
 
     def add(self, item: T) -> None:
         """Add <item> to this PriorityQueue.
 
         NOTE: See the docstring for the 'remove' method for a sample doctest.
         """
+        priority = item if self._key is None else self._key(item)
+        heapq.heappush(self._heap, (priority, self._counter, item))
+        self._counter += 1
+
+    def add_many(self, items: Iterable[T]) -> None:
+        """Add every item in <items> to this PriorityQueue, in order.
 
-        if self._queue == []:
-            self._queue.insert(0, item)
+        This is equivalent to calling add on each item, but a large batch is
+        heapified in linear time instead of being pushed one by one.
+
+        >>> pq = PriorityQueue()
+        >>> pq.add_many(['fred', 'arju', 'monalisa', 'arju'])
+        >>> [pq.remove() for _ in range(4)]
+        ['arju', 'arju', 'fred', 'monalisa']
+        """
+        key = self._key
+        first = self._counter
+        entries = [(item if key is None else key(item), first + i, item)
+                   for i, item in enumerate(items)]
+        self._counter += len(entries)
+
+        if len(entries) < len(self._heap):
+            for entry in entries:
+                heapq.heappush(self._heap, entry)
         else:
-            index = 0
-            for i in range(len(self._queue)):
-                if self._queue[i] <= item:
-                    index = i
-                    break
-                # if item is the smallest among all the item in queue
-                if i == len(self._queue)-1 and item < self._queue[i]:
-                    index = i+1
-            self._queue.insert(index, item)
+            self._heap.extend(entries)
+            heapq.heapify(self._heap)
 
     def remove(self) -> Optional[T]:
         """Remove and return the next item from this PriorityQueue.
@@ -107,7 +149,22 @@ class PriorityQueue(Container[T]):
         >>> pq.remove()
         'monalisa'
         """
-        return self._queue.pop()
+        return heapq.heappop(self._heap)[2]
+
+    def peek(self) -> Optional[T]:
+        """Return the next item from this PriorityQueue without removing it.
+
+        Precondition: this priority queue is non-empty.
+
+        >>> pq = PriorityQueue()
+        >>> pq.add('fred')
+        >>> pq.add('arju')
+        >>> pq.peek()
+        'arju'
+        >>> len(pq)
+        2
+        """
+        return self._heap[0][2]
 
     def is_empty(self) -> bool:
         """Return True iff this PriorityQueue is empty.
@@ -119,7 +176,12 @@ class PriorityQueue(Container[T]):
         >>> pq.is_empty()
         False
         """
-        return not self._queue
+        return not self._heap
+
+    def __len__(self) -> int:
+        """Return the number of items in this PriorityQueue.
+        """
+        return len(self._heap)
 
 
 if __name__ == '__main__':
@@ -130,6 +192,6 @@ if __name__ == '__main__':
 
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'doctest', 'python_ta', 'typing'
+            'doctest', 'python_ta', 'typing', 'heapq'
         ],
     })
@@ -0,0 +1,274 @@
+"""Assignment 1 - On-disk data cache
+
+=== CSC148 Fall 2017 ===
+Diane Horton and David Liu
+Department of Computer Science,
+University of Toronto
+
+
+=== Module Description ===
+
+This file contains a cache for the parsed stations and rides of a
+simulation, so that the JSON and CSV data files only have to be parsed once.
+
+Each cache entry is a directory holding one NumPy .npy file per column and
+a meta.json file describing the source file the columns were parsed from:
+its path, size, modification time and SHA-256 hash. An entry is only used
+if its source file has not changed since; otherwise the source is parsed
+again and the entry is replaced. Ride columns are memory-mapped when they
+are read back, so loading a cached RideTable does not read the whole file.
+
+Several processes can share a cache. An entry is written in a temporary
+directory and renamed into place in one step, and the column files of an
+entry are never changed once it is in place, so columns that another
+process has memory-mapped stay valid.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from bikeshare import Station
+from ridestore import RideTable, create_ride_table
+
+# Version of the cache layout. Entries written with another version are
+# never used.
+CACHE_VERSION = 1
+
+# Number of bytes read at a time when hashing a source file.
+_CHUNK_SIZE = 1 << 20
+
+
+def cached_stations(stations_file: str, cache_dir: str,
+                    create: Callable[[str], Dict[str, Station]]
+                    ) -> Dict[str, Station]:
+    """Return the stations described in <stations_file>, using the cache in
+    <cache_dir>.
+
+    <create> parses the file when the cache has no valid entry for it,
+    for example simulation.create_stations.
+    """
+    entry = _entry_dir(cache_dir, 'stations', stations_file, '')
+    columns = _read_entry(entry, stations_file, '')
+    if columns is not None:
+        stations = {}
+        for id_, name, long, lat, capacity, num_bikes in zip(
+                columns['ids'].tolist(), columns['names'].tolist(),
+                columns['long'].tolist(), columns['lat'].tolist(),
+                columns['capacity'].tolist(), columns['num_bikes'].tolist()):
+            stations[id_] = Station((long, lat), capacity, num_bikes, name)
+        return stations
+
+    digest = _file_hash(stations_file)
+    stations = create(stations_file)
+    _write_entry(entry, stations_file, '', digest, {
+        'ids': np.array(list(stations), dtype=str),
+        'names': np.array([s.name for s in stations.values()], dtype=str),
+        'long': np.array([s.location[0] for s in stations.values()],
+                         dtype=np.float64),
+        'lat': np.array([s.location[1] for s in stations.values()],
+                        dtype=np.float64),
+        'capacity': np.array([s.capacity for s in stations.values()],
+                             dtype=np.int64),
+        'num_bikes': np.array([s.num_bikes for s in stations.values()],
+                              dtype=np.int64)
+    })
+    return stations
+
+
+def cached_ride_table(rides_file: str, stations: Dict[str, Station],
+                      cache_dir: str) -> RideTable:
+    """Return the rides described in <rides_file> as a RideTable, using the
+    cache in <cache_dir>.
+
+    The table depends on which stations are in <stations>, and in what
+    order, so a separate entry is kept for each list of station ids.
+    """
+    station_ids = list(stations)
+    key = hashlib.sha256('\n'.join(station_ids).encode()).hexdigest()
+    entry = _entry_dir(cache_dir, 'rides', rides_file, key)
+    columns = _read_entry(entry, rides_file, key)
+    if columns is not None:
+        return RideTable(station_ids, columns['start_station'],
+                         columns['end_station'], columns['start_minute'],
+                         columns['end_minute'])
+
+    digest = _file_hash(rides_file)
+    table = create_ride_table(rides_file, stations)
+    _write_entry(entry, rides_file, key, digest, {
+        'start_station': table.start_station,
+        'end_station': table.end_station,
+        'start_minute': table.start_minute,
+        'end_minute': table.end_minute
+    })
+    return table
+
+
+def _entry_dir(cache_dir: str, kind: str, source: str, key: str) -> str:
+    """Return the directory of the cache entry of the given <kind> for the
+    file <source> and the extra <key>.
+    """
+    name = hashlib.sha256(
+        (os.path.abspath(source) + '\n' + key).encode()).hexdigest()
+    return os.path.join(cache_dir, '{}-{}'.format(kind, name[:24]))
+
+
+def _file_hash(path: str) -> str:
+    """Return the SHA-256 hash of the contents of the file <path>.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _source_meta(source: str, key: str, digest: str) -> Dict[str, object]:
+    """Return the metadata identifying the current version of the file
+    <source>, whose hash is <digest>.
+    """
+    info = os.stat(source)
+    return {
+        'version': CACHE_VERSION,
+        'path': os.path.abspath(source),
+        'size': info.st_size,
+        'mtime_ns': info.st_mtime_ns,
+        'sha256': digest,
+        'key': key
+    }
+
+
+def _read_entry(entry: str, source: str,
+                key: str) -> Optional[Dict[str, np.ndarray]]:
+    """Return the columns stored in the cache entry <entry>, or None if there
+    is no such entry or it was not parsed from the current version of the
+    file <source>.
+
+    A source whose size and modification time are unchanged is trusted
+    without being hashed again. If only its modification time changed, it
+    is hashed, and the entry is kept if the contents are still the same.
+    """
+    meta = _current_meta(entry, source, key)
+    if meta is None:
+        return None
+
+    columns = {}
+    try:
+        for name in meta['columns']:
+            columns[name] = np.load(os.path.join(entry, name + '.npy'),
+                                    mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+    return columns
+
+
+def _current_meta(entry: str, source: str,
+                  key: str) -> Optional[Dict[str, object]]:
+    """Return the metadata of the cache entry <entry>, or None if there is
+    no such entry or it was not parsed from the current version of the file
+    <source>.
+
+    If only the modification time of <source> changed, and its contents
+    are still the same, the metadata file is replaced with one that has the
+    new modification time.
+    """
+    try:
+        with open(os.path.join(entry, 'meta.json')) as file:
+            meta = json.load(file)
+        info = os.stat(source)
+    except (OSError, ValueError):
+        return None
+
+    if meta.get('version') != CACHE_VERSION or meta.get('key') != key or \
+            meta.get('path') != os.path.abspath(source) or \
+            meta.get('size') != info.st_size:
+        return None
+    if meta.get('mtime_ns') != info.st_mtime_ns:
+        digest = _file_hash(source)
+        if meta.get('sha256') != digest:
+            return None
+        _write_meta(entry, _source_meta(source, key, digest),
+                    meta['columns'])
+    return meta
+
+
+def _write_entry(entry: str, source: str, key: str, digest: str,
+                 columns: Dict[str, np.ndarray]) -> None:
+    """Store <columns> in the cache entry <entry>, as parsed from the file
+    <source> whose hash was <digest> before it was parsed.
+
+    The entry is written in a new temporary directory of the cache, with
+    its metadata last, and renamed to <entry> once it is complete. An
+    out-of-date entry in the way is moved aside and deleted first; the
+    processes that have its files open can go on reading them. If another
+    process puts its own entry in place first, that entry is kept and this
+    one is discarded.
+    """
+    cache_dir = os.path.dirname(entry)
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=cache_dir)
+    try:
+        for name, column in columns.items():
+            np.save(os.path.join(temp_dir, name + '.npy'),
+                    np.asarray(column))
+        _write_meta(temp_dir, _source_meta(source, key, digest),
+                    list(columns))
+
+        if os.path.exists(entry) and \
+                _current_meta(entry, source, key) is None:
+            _discard(entry)
+        try:
+            os.rename(temp_dir, entry)
+        except OSError:
+            pass  # Another process won the race: keep its entry.
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def _discard(entry: str) -> None:
+    """Move the cache entry <entry> out of the way and delete it.
+
+    Nothing happens if another process moved it first.
+    """
+    stale_dir = tempfile.mkdtemp(prefix='.stale-',
+                                 dir=os.path.dirname(entry))
+    try:
+        os.rename(entry, os.path.join(stale_dir, 'entry'))
+    except OSError:
+        pass
+    shutil.rmtree(stale_dir, ignore_errors=True)
+
+
+def _write_meta(entry: str, meta: Dict[str, object],
+                columns: List[str]) -> None:
+    """Write the metadata file of the cache entry <entry>, which stores the
+    given <columns>.
+
+    It is written to a temporary file of its own first, and then renamed
+    over the old metadata file in one step.
+    """
+    meta = dict(meta, columns=columns)
+    handle, temp_file = tempfile.mkstemp(prefix='.meta-', dir=entry)
+    try:
+        with os.fdopen(handle, 'w') as file:
+            json.dump(meta, file)
+        os.replace(temp_file, os.path.join(entry, 'meta.json'))
+    except OSError:
+        os.remove(temp_file)
+        raise
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-io': ['_file_hash', '_current_meta', '_write_meta'],
+        'allowed-import-modules': [
+            'doctest', 'python_ta', 'typing',
+            'hashlib', 'json', 'os', 'shutil', 'tempfile', 'numpy',
+            'bikeshare', 'ridestore'
+        ]
+    })
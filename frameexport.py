@@ -0,0 +1,115 @@
+"""Assignment 1 - Frame export
+
+=== CSC148 Fall 2017 ===
+Diane Horton and David Liu
+Department of Computer Science,
+University of Toronto
+
+
+=== Module Description ===
+
+This file contains the FrameWriter class, which saves the frames of an
+off-screen simulation as a numbered sequence of PNG images.
+
+Encoding a PNG image takes much longer than rendering the frame, so the
+frames are encoded and written by a pool of worker processes while the
+simulation goes on rendering the next frames.
+"""
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+import os
+from typing import Deque, Optional, Tuple
+
+import pygame
+
+# Name of the image file of each frame, given the number of the frame.
+FRAME_FILE = 'frame{:06d}.png'
+
+
+class FrameWriter:
+    """A writer of frames to a directory of numbered PNG images.
+
+    The first frame is saved as frame000000.png, the second one as
+    frame000001.png, and so on.
+
+    === Attributes ===
+    directory:
+        The directory where the frames are saved.
+    size:
+        The width and height of each frame, in pixels.
+    count:
+        The number of frames given to this writer so far.
+
+    === Private Attributes ===
+    _pool:
+        The worker processes that encode and save the frames.
+    _pending:
+        The frames that are being saved, oldest first.
+    _max_pending:
+        The number of frames that may be waiting to be saved before write
+        waits for the oldest one. This bounds the memory taken by frames.
+    """
+    directory: str
+    size: Tuple[int, int]
+    count: int
+    _pool: ProcessPoolExecutor
+    _pending: Deque[Future]
+    _max_pending: int
+
+    def __init__(self, directory: str, size: Tuple[int, int],
+                 workers: Optional[int] = None) -> None:
+        """Initialize a writer of frames of the given <size> to <directory>,
+        which is created if it does not exist.
+
+        The frames are saved by <workers> processes, or by one process per
+        CPU if <workers> is None.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.size = size
+        self.count = 0
+        self._pool = ProcessPoolExecutor(workers)
+        self._pending = deque()
+        self._max_pending = 2 * (workers or os.cpu_count() or 1)
+
+    def write(self, pixels: bytes) -> None:
+        """Save the next frame, whose pixels are given as RGB bytes.
+
+        The frame is saved in the background. Raise any error that occurred
+        while saving an earlier frame.
+        """
+        while len(self._pending) >= self._max_pending:
+            self._pending.popleft().result()
+        path = os.path.join(self.directory, FRAME_FILE.format(self.count))
+        self._pending.append(
+            self._pool.submit(_save_frame, path, self.size, pixels))
+        self.count += 1
+
+    def close(self) -> None:
+        """Wait until all the frames are saved, and stop the workers.
+
+        Raise any error that occurred while saving a frame.
+        """
+        try:
+            while self._pending:
+                self._pending.popleft().result()
+        finally:
+            self._pool.shutdown()
+
+
+def _save_frame(path: str, size: Tuple[int, int], pixels: bytes) -> None:
+    """Save the frame of the given <size> whose pixels are the RGB bytes
+    <pixels> as a PNG image at <path>.
+    """
+    pygame.image.save(pygame.image.fromstring(pixels, size, 'RGB'), path)
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'doctest', 'python_ta', 'typing',
+            'collections', 'concurrent.futures', 'os', 'pygame'
+        ],
+        'generated-members': 'pygame.*'
+    })
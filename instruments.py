@@ -0,0 +1,125 @@
+"""Assignment 1 - Instrumentation
+
+=== CSC148 Fall 2017 ===
+Diane Horton and David Liu
+Department of Computer Science,
+University of Toronto
+
+
+=== Module Description ===
+
+This file contains the Instruments class, which measures where the time of
+a simulation goes, phase by phase, and counts the work it does.
+
+Functions are timed by wrapping them with Instruments.timed, so a
+simulation without instruments runs exactly the same code as before.
+"""
+from time import perf_counter
+from typing import Callable, Dict, Optional
+
+# The phases that are timed, in the order they are reported.
+PHASES = ['ingestion', 'events', 'statistics', 'rendering']
+
+# The counters that are kept, in the order they are reported.
+COUNTERS = ['events', 'ignored_starts', 'ignored_ends', 'frames',
+            'queue_high_water']
+
+
+class Instruments:
+    """Cumulative timers and counters of the work done by a simulation.
+
+    === Attributes ===
+    timers:
+        The total time spent in each phase of PHASES, in seconds.
+    counters:
+        The value of each counter of COUNTERS.
+
+    === Private Attributes ===
+    _phase:
+        The phase of the timed call that is going on, or None.
+
+    === Representation Invariants ===
+    - timers has exactly the keys in PHASES
+    - counters has exactly the keys in COUNTERS
+    """
+    timers: Dict[str, float]
+    counters: Dict[str, int]
+    _phase: Optional[str]
+
+    def __init__(self) -> None:
+        """Initialize instruments with all timers and counters at zero.
+        """
+        self.timers = {phase: 0.0 for phase in PHASES}
+        self.counters = {counter: 0 for counter in COUNTERS}
+        self._phase = None
+
+    def timed(self, phase: str, function: Callable) -> Callable:
+        """Return a function that calls <function> with the same arguments,
+        and adds the time the call took to the timer of <phase>.
+
+        If the call is made during a timed call of another phase, its time
+        is taken out of the timer of that phase, so that no time is counted
+        twice.
+
+        >>> instruments = Instruments()
+        >>> timed_sum = instruments.timed('events', sum)
+        >>> timed_sum([1, 2])
+        3
+        >>> instruments.timers['events'] > 0
+        True
+        """
+        timers = self.timers
+
+        def timed_function(*args: object, **kwargs: object) -> object:
+            outer, self._phase = self._phase, phase
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds = perf_counter() - start
+                timers[phase] += seconds
+                if outer is not None:
+                    timers[outer] -= seconds
+                self._phase = outer
+        return timed_function
+
+    def add_time(self, phase: str, seconds: float) -> None:
+        """Add <seconds> to the timer of <phase>.
+        """
+        self.timers[phase] += seconds
+
+    def count(self, counter: str, amount: int = 1) -> None:
+        """Add <amount> to <counter>.
+        """
+        self.counters[counter] += amount
+
+    def high_water(self, counter: str, value: int) -> None:
+        """Raise <counter> to <value>, if it is lower.
+        """
+        if value > self.counters[counter]:
+            self.counters[counter] = value
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        """Return a copy of the timers and counters, under the keys 'timers'
+        and 'counters', with the total time of all phases as the timer
+        'total'.
+
+        >>> Instruments().report()['counters']['frames']
+        0
+        """
+        timers = dict(self.timers)
+        timers['total'] = sum(self.timers.values())
+        return {'timers': timers, 'counters': dict(self.counters)}
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'doctest', 'python_ta', 'typing',
+            'time'
+        ]
+    })
@@ -0,0 +1,144 @@
+"""Assignment 1 - Leaderboard
+
+=== CSC148 Fall 2017 ===
+Diane Horton and David Liu
+Department of Computer Science,
+University of Toronto
+
+
+=== Module Description ===
+
+This file contains the Leaderboard class, which keeps track of which
+stations have the largest value of a statistic while the statistic is
+being updated, so that the leader can be read at any moment without
+looking at every station.
+"""
+import heapq
+from typing import Dict, Hashable, List, Tuple
+
+
+class Leaderboard:
+    """A ranking of named items by a value that changes over time.
+
+    Items with larger values rank first. Ties are broken by name, in
+    increasing order, and items with the same name and value are ranked in
+    the order they were given to the leaderboard.
+
+    The items are kept in a heap that is updated lazily: an update pushes a
+    new entry for the item, and the entries of old values are only dropped
+    when they reach the top of the heap, or when the heap is rebuilt after
+    it has grown to twice the number of items.
+
+    === Private Attributes ===
+    _values:
+        The current value of each item.
+    _names:
+        The (name, order) of each item, where order is the position of the
+        item when the leaderboard was created.
+    _heap:
+        A heap of (-value, name, order, item) entries. An entry is current
+        if value is the current value of item, and stale otherwise.
+
+    === Representation Invariants ===
+    - every item has a current entry in _heap
+    """
+    _values: Dict[Hashable, float]
+    _names: Dict[Hashable, Tuple[str, int]]
+    _heap: List[Tuple[float, str, int, Hashable]]
+
+    def __init__(self, names: Dict[Hashable, str],
+                 values: Dict[Hashable, float]) -> None:
+        """Initialize a leaderboard of the items in <names>, where names[item]
+        is the name of the item and values[item] is its current value.
+
+        Precondition: <names> and <values> have the same keys.
+
+        >>> board = Leaderboard({1: 'b', 2: 'a'}, {1: 0, 2: 0})
+        >>> board.leader()
+        ('a', 0)
+        """
+        self._values = dict(values)
+        self._names = {item: (names[item], order)
+                       for order, item in enumerate(names)}
+        self._rebuild()
+
+    def _rebuild(self) -> None:
+        """Replace _heap with a heap of only the current entries.
+        """
+        self._heap = [(-value, *self._names[item], item)
+                      for item, value in self._values.items()]
+        heapq.heapify(self._heap)
+
+    def _is_current(self, entry: Tuple[float, str, int, Hashable]) -> bool:
+        """Return whether <entry> of _heap is current.
+        """
+        return self._values[entry[3]] == -entry[0]
+
+    def update(self, item: Hashable, value: float) -> None:
+        """Change the value of <item> to <value>.
+
+        >>> board = Leaderboard({1: 'b', 2: 'a'}, {1: 0, 2: 0})
+        >>> board.update(1, 5)
+        >>> board.leader()
+        ('b', 5)
+        """
+        if self._values[item] == value:
+            return
+        self._values[item] = value
+        if len(self._heap) >= 2 * len(self._values):
+            self._rebuild()
+        else:
+            heapq.heappush(self._heap, (-value, *self._names[item], item))
+
+    def value(self, item: Hashable) -> float:
+        """Return the current value of <item>.
+        """
+        return self._values[item]
+
+    def leader(self) -> Tuple[str, float]:
+        """Return the name and value of the item that ranks first.
+
+        Precondition: this leaderboard has at least one item.
+        """
+        heap = self._heap
+        while not self._is_current(heap[0]):
+            heapq.heappop(heap)
+        return heap[0][1], -heap[0][0]
+
+    def top(self, k: int) -> List[Tuple[str, float]]:
+        """Return the names and values of the <k> items that rank first, in
+        order. Fewer items are returned if there are less than <k>.
+
+        >>> board = Leaderboard({1: 'b', 2: 'a', 3: 'c'}, {1: 2, 2: 1, 3: 2})
+        >>> board.top(2)
+        [('b', 2), ('c', 2)]
+        >>> board.update(3, 0)
+        >>> board.update(3, 2)
+        >>> board.top(3)
+        [('b', 2), ('c', 2), ('a', 1)]
+        """
+        heap = self._heap
+        popped = []
+        seen = set()
+        while heap and len(popped) < k:
+            entry = heapq.heappop(heap)
+            # An item that went back to an old value has two current entries.
+            if self._is_current(entry) and entry[3] not in seen:
+                seen.add(entry[3])
+                popped.append(entry)
+        for entry in popped:
+            heapq.heappush(heap, entry)
+        return [(entry[1], -entry[0]) for entry in popped]
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'doctest', 'python_ta', 'typing',
+            'heapq'
+        ]
+    })
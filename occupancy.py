@@ -0,0 +1,197 @@
+"""Assignment 1 - Occupancy history
+
+=== CSC148 Fall 2017 ===
+Diane Horton and David Liu
+Department of Computer Science,
+University of Toronto
+
+
+=== Module Description ===
+
+This file contains the OccupancyHistory class, which records the number of
+bikes at every station throughout a run of the simulation, so that it can
+be queried over any part of the run afterwards.
+
+Only the minutes at which the number of bikes of a station changes are
+stored, with the new number of bikes, so the history takes memory in
+proportion to the number of changes rather than to the number of stations
+times the number of minutes. Queries find the changes in a time range by
+binary search.
+"""
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from ridestore import from_minute, to_minute
+
+
+class OccupancyHistory:
+    """The number of bikes at each station during a simulation time period.
+
+    The number of bikes that a station has at a minute is the one it has
+    once the rides that start and end at that minute are processed. Times
+    are in minutes since EPOCH, and are given to queries as datetimes.
+
+    === Attributes ===
+    start:
+        The first minute of the recorded time period.
+    end:
+        The last minute of the recorded time period.
+
+    === Private Attributes ===
+    _index:
+        The position of each station id in _minutes and _bikes.
+    _minutes:
+        For each station, the minutes at which its number of bikes changed,
+        in increasing order, starting with start.
+    _bikes:
+        For each station, its number of bikes from each minute of _minutes
+        on.
+
+    === Representation Invariants ===
+    - start <= end
+    - _minutes[i] and _bikes[i] have the same length, at least 1
+    - _minutes[i][0] == start, and all of _minutes[i] are <= end
+    """
+    start: int
+    end: int
+    _index: Dict[str, int]
+    _minutes: List[List[int]]
+    _bikes: List[List[int]]
+
+    def __init__(self, station_ids: List[str], num_bikes: List[int],
+                 start: int) -> None:
+        """Initialize the history of the stations whose ids are <station_ids>,
+        and whose numbers of bikes are <num_bikes> at the minute <start>.
+        """
+        self.start = self.end = start
+        self._index = {id_: i for i, id_ in enumerate(station_ids)}
+        self._minutes = [[start] for _ in station_ids]
+        self._bikes = [[bikes] for bikes in num_bikes]
+
+    def record(self, index: int, minute: int, num_bikes: int) -> None:
+        """Record that the station at <index> has <num_bikes> bikes from
+        <minute> on.
+
+        Precondition: <minute> is not before any minute recorded so far.
+        """
+        minutes, bikes = self._minutes[index], self._bikes[index]
+        if minutes[-1] == minute:
+            bikes[-1] = num_bikes
+            if len(bikes) > 1 and bikes[-2] == num_bikes:
+                del minutes[-1], bikes[-1]
+        elif bikes[-1] != num_bikes:
+            minutes.append(minute)
+            bikes.append(num_bikes)
+        self.end = max(self.end, minute)
+
+    def finish(self, minute: int) -> None:
+        """Record that the time period ends at <minute>.
+        """
+        self.end = max(self.end, minute)
+
+    def changes(self, station_id: str) -> List[Tuple[datetime, int]]:
+        """Return the times at which the number of bikes at the station with
+        id <station_id> changed, with the new number of bikes, starting
+        with the start of the time period.
+        """
+        i = self._index[station_id]
+        return [(from_minute(minute), bikes)
+                for minute, bikes in zip(self._minutes[i], self._bikes[i])]
+
+    def num_bikes(self, station_id: str, time: datetime) -> int:
+        """Return the number of bikes at the station with id <station_id> at
+        <time>.
+
+        Raise ValueError if <time> is outside the recorded time period.
+        """
+        minute = self._check(time, time)[0]
+        i = self._index[station_id]
+        return self._bikes[i][bisect_right(self._minutes[i], minute) - 1]
+
+    def minimum(self, station_id: str, start: datetime,
+                end: datetime) -> int:
+        """Return the smallest number of bikes at the station with id
+        <station_id> from <start> to <end>, inclusive.
+
+        Raise ValueError if the time range is empty or not within the
+        recorded time period.
+        """
+        return min(bikes for bikes, _ in
+                   self._pieces(station_id, start, end))
+
+    def maximum(self, station_id: str, start: datetime,
+                end: datetime) -> int:
+        """Return the largest number of bikes at the station with id
+        <station_id> from <start> to <end>, inclusive.
+
+        Raise ValueError as in minimum.
+        """
+        return max(bikes for bikes, _ in
+                   self._pieces(station_id, start, end))
+
+    def mean(self, station_id: str, start: datetime, end: datetime) -> float:
+        """Return the mean number of bikes at the station with id
+        <station_id> over the minutes from <start> to <end>, inclusive.
+
+        Raise ValueError as in minimum.
+        """
+        pieces = self._pieces(station_id, start, end)
+        return sum(bikes * minutes for bikes, minutes in pieces) / \
+            sum(minutes for _, minutes in pieces)
+
+    def time_below(self, station_id: str, threshold: int, start: datetime,
+                   end: datetime) -> int:
+        """Return the time, in seconds, during which the station with id
+        <station_id> had fewer than <threshold> bikes, over the minutes
+        from <start> to <end>, inclusive.
+
+        Raise ValueError as in minimum.
+        """
+        return 60 * sum(minutes for bikes, minutes in
+                        self._pieces(station_id, start, end)
+                        if bikes < threshold)
+
+    def _check(self, start: datetime, end: datetime) -> Tuple[int, int]:
+        """Return <start> and <end> in minutes since EPOCH.
+
+        Raise ValueError if the time range from <start> to <end> is empty
+        or not within the recorded time period.
+        """
+        first, last = to_minute(start), to_minute(end)
+        if first > last or first < self.start or last > self.end:
+            raise ValueError('the time range is not within the recorded '
+                             'time period')
+        return first, last
+
+    def _pieces(self, station_id: str, start: datetime,
+                end: datetime) -> List[Tuple[int, int]]:
+        """Return the numbers of bikes that the station with id <station_id>
+        had from <start> to <end>, inclusive, each with the number of
+        minutes during which it had it, in order.
+
+        Raise ValueError as in minimum.
+        """
+        first, last = self._check(start, end)
+        i = self._index[station_id]
+        minutes, bikes = self._minutes[i], self._bikes[i]
+        low = bisect_right(minutes, first) - 1
+        high = bisect_left(minutes, last + 1)
+
+        pieces = []
+        for j in range(low, high):
+            piece_start = max(first, minutes[j])
+            piece_end = last + 1 if j + 1 == high else minutes[j + 1]
+            pieces.append((bikes[j], piece_end - piece_start))
+        return pieces
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'doctest', 'python_ta', 'typing',
+            'bisect', 'datetime',
+            'ridestore'
+        ]
+    })
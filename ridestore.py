@@ -0,0 +1,400 @@
+"""Assignment 1 - Columnar ride store
+
+=== CSC148 Fall 2017 ===
+Diane Horton and David Liu
+Department of Computer Science,
+University of Toronto
+
+
+=== Module Description ===
+
+This file contains the RideTable class, which stores all the rides of a
+simulation column by column in NumPy arrays, instead of as one Ride object
+per ride.
+
+Each ride only takes a few bytes per column: its start and end stations are
+stored as dense indices into a list of station ids, and its start and end
+times are stored as whole minutes since EPOCH. Ride objects are only
+created when they are needed, for example to draw an active ride.
+
+It also contains the fast timestamp parsers used to read ride files, and
+the RideIndex class, which finds the rides of a simulation time period by
+binary search instead of looking at every ride.
+"""
+import csv
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from bikeshare import Ride, Station
+
+# Datetime format to parse the ride data
+DATETIME_FORMAT = '%Y-%m-%d %H:%M'
+
+# Times in a RideTable are stored as whole minutes since this moment.
+EPOCH = datetime(1970, 1, 1)
+MINUTE = timedelta(minutes=1)
+
+# Positions of the digits in a zero-padded 'YYYY-MM-DD HH:MM' timestamp.
+_DIGIT_COLUMNS = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15]
+
+
+def to_minute(time: datetime) -> int:
+    """Return <time> as a whole number of minutes since EPOCH.
+
+    Seconds and microseconds are ignored.
+
+    >>> to_minute(datetime(1970, 1, 2, 0, 1, 30))
+    1441
+    """
+    return (time - EPOCH) // MINUTE
+
+
+def from_minute(minute: int) -> datetime:
+    """Return the time that is <minute> minutes after EPOCH.
+
+    >>> from_minute(to_minute(datetime(2017, 6, 1, 8, 0)))
+    datetime.datetime(2017, 6, 1, 8, 0)
+    """
+    return EPOCH + int(minute) * MINUTE
+
+
+class TimestampParser:
+    """A parser for timestamps in DATETIME_FORMAT.
+
+    Timestamps of the form 'YYYY-MM-DD H:MM' or 'YYYY-MM-DD HH:MM' are
+    parsed by hand. The date of such a timestamp is only validated and
+    converted the first time it is seen, since all the rides of a day
+    share it. Any other text is passed to datetime.strptime, so exactly
+    the same texts are accepted, and malformed ones raise the same
+    ValueError.
+
+    === Private Attributes ===
+    _dates:
+        Maps each 'YYYY-MM-DD' date seen so far to its year, month, day, and
+        its midnight in minutes since EPOCH, or to None if it is not a
+        valid date.
+    """
+    _dates: Dict[str, Optional[Tuple[int, int, int, int]]]
+
+    def __init__(self) -> None:
+        """Initialize a parser with an empty cache of dates.
+        """
+        self._dates = {}
+
+    def parse(self, text: str) -> datetime:
+        """Return the time in <text>, which is in DATETIME_FORMAT.
+
+        >>> parser = TimestampParser()
+        >>> parser.parse('2017-06-01 8:00')
+        datetime.datetime(2017, 6, 1, 8, 0)
+        >>> parser.parse('2017-6-1 08:05')
+        datetime.datetime(2017, 6, 1, 8, 5)
+        """
+        fields = self._fields(text)
+        if fields is None:
+            return datetime.strptime(text, DATETIME_FORMAT)
+        date, hour, minute = fields
+        return datetime(date[0], date[1], date[2], hour, minute)
+
+    def parse_minute(self, text: str) -> int:
+        """Return the time in <text>, which is in DATETIME_FORMAT, in minutes
+        since EPOCH.
+
+        >>> TimestampParser().parse_minute('1970-01-02 0:01')
+        1441
+        """
+        fields = self._fields(text)
+        if fields is None:
+            return to_minute(datetime.strptime(text, DATETIME_FORMAT))
+        date, hour, minute = fields
+        return date[3] + 60 * hour + minute
+
+    def _fields(self, text: str) -> Optional[Tuple[Tuple[int, int, int, int],
+                                                   int, int]]:
+        """Return the date, hour and minute of <text>, or None if <text> is not
+        a valid timestamp of the form 'YYYY-MM-DD H:MM' or 'YYYY-MM-DD HH:MM'.
+        """
+        if len(text) not in (15, 16) or text[10] != ' ' or text[-3] != ':':
+            return None
+        hour, minute = text[11:-3], text[-2:]
+        if not (hour.isascii() and hour.isdigit() and
+                minute.isascii() and minute.isdigit()):
+            return None
+        if int(hour) > 23 or int(minute) > 59:
+            return None
+
+        prefix = text[:10]
+        if prefix not in self._dates:
+            self._dates[prefix] = _parse_date(prefix)
+        date = self._dates[prefix]
+        if date is None:
+            return None
+        return date, int(hour), int(minute)
+
+
+def _parse_date(text: str) -> Optional[Tuple[int, int, int, int]]:
+    """Return the year, month, day and the midnight in minutes since EPOCH of
+    the date <text>, or None if <text> is not a valid 'YYYY-MM-DD' date.
+    """
+    if text[4] != '-' or text[7] != '-':
+        return None
+    digits = text[:4] + text[5:7] + text[8:]
+    if not (digits.isascii() and digits.isdigit()):
+        return None
+    try:
+        midnight = datetime(int(text[:4]), int(text[5:7]), int(text[8:]))
+    except ValueError:
+        return None
+    return midnight.year, midnight.month, midnight.day, to_minute(midnight)
+
+
+def parse_minutes(texts: List[str]) -> np.ndarray:
+    """Return the times in <texts>, which are in DATETIME_FORMAT, in minutes
+    since EPOCH.
+
+    If every text is a zero-padded 'YYYY-MM-DD HH:MM' timestamp from year
+    1 on, the whole column is converted at once with NumPy's datetime64.
+    Otherwise, each text is parsed by a TimestampParser, which raises the
+    same ValueError as datetime.strptime for a malformed text, such as one
+    in year 0, which datetime64 accepts.
+
+    >>> parse_minutes(['1970-01-02 00:01', '1970-01-01 0:02']).tolist()
+    [1441, 2]
+    """
+    column = np.array(texts, dtype=str)
+    if column.size and column.dtype.itemsize == np.dtype('U16').itemsize:
+        chars = column.view('U1').reshape(-1, 16)
+        digits = chars[:, _DIGIT_COLUMNS]
+        if (chars[:, 4] == '-').all() and (chars[:, 7] == '-').all() and \
+                (chars[:, 10] == ' ').all() and (chars[:, 13] == ':').all() \
+                and ((digits >= '0') & (digits <= '9')).all() \
+                and (chars[:, :4] != '0').any(axis=1).all():
+            try:
+                return column.astype('datetime64[m]').astype(np.int64)
+            except ValueError:
+                pass  # An invalid date or time: let the parser report it.
+
+    parser = TimestampParser()
+    return np.array([parser.parse_minute(text) for text in texts],
+                    dtype=np.int64)
+
+
+class RideTable:
+    """All the rides of a simulation, stored column by column.
+
+    Row i of every column describes the same ride, and rows are in the
+    order the rides were read.
+
+    === Attributes ===
+    station_ids:
+        The id of each station that rides refer to. The position of an id
+        in this list is the dense index used by start_station and
+        end_station.
+    start_station:
+        The dense index of the station where each ride starts.
+    end_station:
+        The dense index of the station where each ride ends.
+    start_minute:
+        The time each ride starts, in minutes since EPOCH.
+    end_minute:
+        The time each ride ends, in minutes since EPOCH.
+
+    === Representation Invariants ===
+    - all columns have the same length
+    - 0 <= start_station[i], end_station[i] < len(station_ids)
+    - start_minute[i] < end_minute[i]
+    """
+    station_ids: List[str]
+    start_station: np.ndarray
+    end_station: np.ndarray
+    start_minute: np.ndarray
+    end_minute: np.ndarray
+
+    def __init__(self, station_ids: List[str], start_station: np.ndarray,
+                 end_station: np.ndarray, start_minute: np.ndarray,
+                 end_minute: np.ndarray) -> None:
+        """Initialize a ride table from its columns.
+        """
+        self.station_ids = station_ids
+        self.start_station = np.asarray(start_station, dtype=np.int32)
+        self.end_station = np.asarray(end_station, dtype=np.int32)
+        self.start_minute = np.asarray(start_minute, dtype=np.int64)
+        self.end_minute = np.asarray(end_minute, dtype=np.int64)
+
+    def __len__(self) -> int:
+        """Return the number of rides in this table.
+        """
+        return len(self.start_minute)
+
+    @property
+    def duration(self) -> np.ndarray:
+        """The duration of each ride, in minutes.
+        """
+        return self.end_minute - self.start_minute
+
+    def rides(self, stations: List[Station]) -> List[Ride]:
+        """Return a new Ride object for every ride in this table, in order.
+
+        <stations> is as in the ride method.
+        """
+        return [Ride(stations[start], stations[end],
+                     (from_minute(start_minute), from_minute(end_minute)))
+                for start, end, start_minute, end_minute in zip(
+                    self.start_station.tolist(), self.end_station.tolist(),
+                    self.start_minute.tolist(), self.end_minute.tolist())]
+
+    def ride(self, index: int, stations: List[Station]) -> Ride:
+        """Return a new Ride object for the ride in row <index>.
+
+        <stations> holds the Station object for each dense station index,
+        i.e. stations[i] is the station whose id is station_ids[i].
+        """
+        return Ride(stations[self.start_station[index]],
+                    stations[self.end_station[index]],
+                    (from_minute(self.start_minute[index]),
+                     from_minute(self.end_minute[index])))
+
+
+class RideIndex:
+    """An index of rides by their start and end times.
+
+    Times are integers in any unit, such as minutes since EPOCH. Rides are
+    identified by their position in the columns the index was built from.
+
+    To find the rides on the way at a given time, the rides are split into
+    buckets by duration, where the longest ride of a bucket is less than
+    twice as long as its shortest one. In each bucket, only the rides that
+    start at most its longest duration before the time are looked at. All
+    the rides of a bucket that start in the last half of that window are
+    on the way, and a few very long rides do not slow down the search among
+    the others.
+
+    === Private Attributes ===
+    _start_time:
+        The start time of each ride.
+    _end_time:
+        The end time of each ride.
+    _by_start:
+        The positions of the rides, in order of start time.
+    _starts:
+        The start time of each ride of _by_start.
+    _buckets:
+        The (positions, start times, longest duration) of the rides of each
+        bucket, with the positions in order of start time.
+    """
+    _start_time: np.ndarray
+    _end_time: np.ndarray
+    _by_start: np.ndarray
+    _starts: np.ndarray
+    _buckets: List[Tuple[np.ndarray, np.ndarray, int]]
+
+    def __init__(self, start_time: np.ndarray,
+                 end_time: np.ndarray) -> None:
+        """Initialize an index of the rides whose start and end times are
+        given by <start_time> and <end_time>.
+
+        Precondition: start_time[i] < end_time[i] for every ride i.
+        """
+        start_time = np.asarray(start_time, dtype=np.int64)
+        end_time = np.asarray(end_time, dtype=np.int64)
+        self._start_time, self._end_time = start_time, end_time
+        self._by_start = np.argsort(start_time, kind='stable')
+        self._starts = start_time[self._by_start]
+
+        # Rides of durations from 2 ** k to 2 ** (k + 1) - 1 are in bucket k.
+        durations = (end_time - start_time)[self._by_start]
+        classes = np.floor(np.log2(np.maximum(durations, 1))).astype(np.int64)
+        self._buckets = []
+        for bucket in np.unique(classes).tolist():
+            members = classes == bucket
+            self._buckets.append((self._by_start[members],
+                                  self._starts[members],
+                                  int(durations[members].max())))
+
+    def __len__(self) -> int:
+        """Return the number of rides in this index.
+        """
+        return len(self._by_start)
+
+    def starting(self, first: int, last: int,
+                 by_time: bool = False) -> np.ndarray:
+        """Return the positions of the rides that start from <first> to
+        <last>, inclusive, in increasing order.
+
+        If <by_time> is True, they are in order of start time instead, and
+        rides that start at the same time are in increasing order.
+
+        >>> index = RideIndex(np.array([5, 1, 3]), np.array([6, 4, 9]))
+        >>> index.starting(2, 5).tolist()
+        [0, 2]
+        >>> index.starting(2, 5, by_time=True).tolist()
+        [2, 0]
+        """
+        low = np.searchsorted(self._starts, first, 'left')
+        high = np.searchsorted(self._starts, last, 'right')
+        if by_time:
+            return self._by_start[low:high]
+        return np.sort(self._by_start[low:high])
+
+    def straddling(self, time: int) -> np.ndarray:
+        """Return the positions of the rides that start before <time> and
+        end at or after <time>, in increasing order.
+
+        >>> index = RideIndex(np.array([5, 1, 3]), np.array([6, 4, 9]))
+        >>> index.straddling(4).tolist()
+        [1, 2]
+        """
+        found = [np.empty(0, dtype=np.int64)]
+        for rides, starts, longest in self._buckets:
+            low = np.searchsorted(starts, time - longest, 'left')
+            high = np.searchsorted(starts, time, 'left')
+            candidates = rides[low:high]
+            found.append(candidates[self._end_time[candidates] >= time])
+        return np.sort(np.concatenate(found))
+
+
+def create_ride_table(rides_file: str,
+                      stations: Dict[str, Station]) -> RideTable:
+    """Return the rides described in the given CSV file as a RideTable.
+
+    The dense station indices of the table follow the order of <stations>.
+    Like create_rides, ignore any ride whose start or end station is not
+    present in <stations>.
+
+    === Precondition ===
+    rides_file matches the format specified in the assignment handout.
+    """
+    station_ids = list(stations)
+    index_of = {id_: i for i, id_ in enumerate(station_ids)}
+
+    start_station, end_station = [], []
+    start_text, end_text = [], []
+    with open(rides_file) as file:
+        for line in csv.reader(file):
+            if line[1] in index_of and line[3] in index_of:
+                start_station.append(index_of[line[1]])
+                end_station.append(index_of[line[3]])
+                start_text.append(line[0])
+                end_text.append(line[2])
+
+    # The times are converted column by column, once the file is read.
+    return RideTable(station_ids, np.array(start_station, dtype=np.int32),
+                     np.array(end_station, dtype=np.int32),
+                     parse_minutes(start_text), parse_minutes(end_text))
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-io': ['create_ride_table'],
+        'allowed-import-modules': [
+            'doctest', 'python_ta', 'typing',
+            'csv', 'datetime', 'numpy',
+            'bikeshare'
+        ]
+    })
@@ -0,0 +1,139 @@
+"""Assignment 1 - Scenario runner
+
+=== CSC148 Fall 2017 ===
+Diane Horton and David Liu
+Department of Computer Science,
+University of Toronto
+
+
+=== Module Description ===
+
+This file contains the run_scenarios function, which runs many headless
+simulations over the same data files in parallel, in a pool of worker
+processes.
+
+The stations and rides are only loaded once. Where processes can be
+forked, the workers share the loaded simulation with the main process,
+copy-on-write, instead of loading it again; a columnar simulation is best
+for this, since its rides are kept in a few NumPy arrays. Elsewhere, each
+worker loads the simulation once when it starts. Each worker then reuses
+its simulation for every scenario it runs, resetting it in between. By
+default, each run skips its idle minutes, which does not change its
+statistics.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import multiprocessing
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from simulation import Simulation
+
+# The simulation that the scenarios of a worker process are run with.
+_simulation: Optional[Simulation] = None
+
+
+class Scenario:
+    """A simulation time period and station configuration to run.
+
+    === Attributes ===
+    start:
+        The start of the simulation time period.
+    end:
+        The end of the simulation time period.
+    stations:
+        Maps the ids of some stations to the (capacity, number of bikes)
+        they have at the start of the scenario, instead of the ones in the
+        stations file.
+    skip_idle:
+        Whether the run of the scenario skips the minutes when nothing
+        happens, as Simulation.run does.
+
+    === Representation Invariants ===
+    - start < end
+    """
+    start: datetime
+    end: datetime
+    stations: Dict[str, Tuple[int, int]]
+    skip_idle: bool
+
+    def __init__(self, start: datetime, end: datetime,
+                 stations: Optional[Dict[str, Tuple[int, int]]] = None,
+                 skip_idle: bool = True) -> None:
+        """Initialize a scenario from <start> to <end>.
+        """
+        self.start = start
+        self.end = end
+        self.stations = stations or {}
+        self.skip_idle = skip_idle
+
+
+def run_scenarios(station_file: str, ride_file: str,
+                  scenarios: List[Scenario], workers: Optional[int] = None,
+                  columnar: bool = False, cache_dir: Optional[str] = None
+                  ) -> Iterator[Tuple[int, Dict[str, Tuple[str, float]]]]:
+    """Run a headless simulation of <station_file> and <ride_file> for each
+    scenario in <scenarios>, using <workers> processes, or one per CPU if
+    <workers> is None.
+
+    Yield (i, statistics) as soon as scenarios[i] is over, where statistics
+    is what calculate_statistics returns at the end of its run. Each
+    scenario runs as if it were the first run of a new simulation.
+    <columnar> and <cache_dir> are passed on to the Simulation.
+
+    The simulation shared with forked workers is released, and the workers
+    are stopped, when the returned iterator is exhausted, fails or is
+    closed. Close it to stop early: the scenarios that have not started by
+    then are never run.
+    """
+    global _simulation
+    pool = None
+    try:
+        if 'fork' in multiprocessing.get_all_start_methods():
+            _simulation = Simulation(station_file, ride_file, headless=True,
+                                     columnar=columnar, cache_dir=cache_dir)
+            pool = ProcessPoolExecutor(workers,
+                                       multiprocessing.get_context('fork'))
+        else:
+            pool = ProcessPoolExecutor(
+                workers, initializer=_load_simulation,
+                initargs=(station_file, ride_file, columnar, cache_dir))
+        futures = {pool.submit(_run_scenario, scenario): i
+                   for i, scenario in enumerate(scenarios)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        if pool is not None:
+            # The scenarios that no worker has taken yet are cancelled, so
+            # that stopping early does not wait for them to run.
+            pool.shutdown(wait=True, cancel_futures=True)
+        _simulation = None
+
+
+def _load_simulation(station_file: str, ride_file: str, columnar: bool,
+                     cache_dir: Optional[str]) -> None:
+    """Load the simulation of a worker process that was not forked.
+    """
+    global _simulation
+    _simulation = Simulation(station_file, ride_file, headless=True,
+                             columnar=columnar, cache_dir=cache_dir)
+
+
+def _run_scenario(scenario: Scenario) -> Dict[str, Tuple[str, float]]:
+    """Run <scenario> with the simulation of this worker process, and return
+    its statistics.
+    """
+    _simulation.reset(scenario.stations)
+    _simulation.run(scenario.start, scenario.end,
+                    skip_idle=scenario.skip_idle)
+    return _simulation.calculate_statistics()
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'doctest', 'python_ta', 'typing',
+            'concurrent.futures', 'datetime', 'multiprocessing',
+            'simulation'
+        ]
+    })
@@ -17,14 +17,25 @@ can use to try running the simulation at any time.
 import csv
 from datetime import datetime, timedelta
 import json
-from typing import Dict, List, Tuple, Optional
+import os
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Tuple, Optional, Union
 
-from bikeshare import Ride, Station
+import numpy as np
+
+from bikeshare import Ride, Station, StationGroup, group_stations
 from container import PriorityQueue
-from visualizer import Visualizer
+from datacache import cached_ride_table, cached_stations
+from frameexport import FrameWriter
+from instruments import Instruments
+from leaderboard import Leaderboard
+from occupancy import OccupancyHistory
+from ridestore import DATETIME_FORMAT, EPOCH, RideIndex, RideTable, \
+    TimestampParser, create_ride_table, from_minute, to_minute
+from visualizer import SCREEN_SIZE, Visualizer
 
-# Datetime format to parse the ride data
-DATETIME_FORMAT = '%Y-%m-%d %H:%M'
+# Name of the checkpoint file of each time, in a checkpoint directory.
+CHECKPOINT_FILE = 'checkpoint-%Y-%m-%d-%H%M.npz'
 
 
 class Simulation:
@@ -32,40 +43,348 @@ class Simulation:
 
     === Attributes ===
     all_rides:
-        A list of all the rides in this simulation.
+        A list of all the rides in this simulation, or a RideTable holding
+        them if this simulation is columnar. It is empty if this simulation
+        is streaming: its rides are then read while it runs.
         Note that not all rides might be used, depending on the timeframe
-        when the simulation is run.
+        when the simulation is run. It may be replaced between runs, but if
+        it is changed in place, rides_changed must be called before the
+        next run.
     all_stations:
         A dictionary containing all the stations in this simulation.
     visualizer:
-        A helper class for visualizing the simulation.
+        A helper class for visualizing the simulation, or None if this
+        simulation is headless. It is off-screen if this simulation exports
+        its frames.
     active_rides:
         A list of ride instances that are active(i.e. on the way)
-        during simulation time period.
+        during simulation time period, in the order they became active.
+        A ride is active from its start time to its end time, inclusive:
+        it is only removed at the next minute that is visited. It is a new
+        list every time it is read.
     priorityqueue:
-        A queue of items that contains Event instances.
-
+        A queue of items that contains Event instances, ordered by
+        Event.key.
+    instruments:
+        The timers and counters of the work done by this simulation, or
+        None if it is not instrumented. See Instruments for the phases and
+        counters.
+    occupancy:
+        The number of bikes at each station during the last run of this
+        simulation, or None if it does not record occupancy or has not run
+        yet.
+
+    === Private Attributes ===
+    _active_rides:
+        The active rides, as an ordered set: each key is an active ride, in
+        the order the rides became active, and each value is None. If
+        all_rides is a RideTable, each key is the row index of the ride in
+        all_rides instead.
+    _ended_rides:
+        The keys of _active_rides of the rides that ended at the last
+        minute that was visited. They are removed from _active_rides at the
+        next one.
+    _rides_by_start:
+        The rides that start during the current run and have not been
+        processed yet, grouped by their start time. It is empty if
+        all_rides is a RideTable.
+    _rides_by_end:
+        The active rides that have not ended yet, grouped by their end time.
+        If all_rides is a RideTable, the row indices of the rides are
+        grouped by their end minute instead.
+    _start_rows:
+        The row indices of the rides of a RideTable all_rides that start
+        during the current run, in order of start minute.
+    _start_minutes:
+        The start minute of each ride of _start_rows.
+    _next_start:
+        The position in _start_rows of the first ride that has not been
+        processed yet.
+    _stations:
+        The station for each dense station index of all_rides, if it is a
+        RideTable.
+    _pending_minutes:
+        The minutes at which rides of a RideTable start or end during the
+        current run, and which have not been reached yet.
+    _drawn_rides:
+        The Ride objects created to draw the active rides of a RideTable,
+        by row index.
+    _station_group:
+        The StationGroup holding the state of all_stations.
+    _leaderboards:
+        A Leaderboard for each of the statistics of calculate_statistics,
+        ranking the stations by their index in _station_group, or None if
+        this simulation does not keep live statistics.
+    _ride_file:
+        The rides file that is read while this simulation runs, or None if
+        this simulation is not streaming.
+    _ride_stream:
+        The rides of _ride_file that have not been read yet during the
+        current run, or None if there are none left to read.
+    _next_ride:
+        The ride that was read last from _ride_stream and has not started
+        yet, or None.
+    _frame_dir:
+        The directory where the frames of each run are exported, or None if
+        this simulation shows its frames in a window.
+    _frame_workers:
+        The number of processes that save exported frames, or None for one
+        per CPU.
+    _initial_group:
+        A copy of _station_group as it was when this simulation was
+        created, used by reset.
+    _resume_rides:
+        The positions in all_rides of the rides that are active at the
+        start of the next run, if it resumes from a checkpoint, or None if
+        the next run starts from the rides on the way at its start.
+    _ride_positions:
+        The position of each ride in the list all_rides, once it has been
+        needed to save a checkpoint. It is built again with _ride_index.
+    _credited:
+        The minute, since EPOCH, up to which the tla and tlu of each
+        station have been credited during the current run, by index in
+        _station_group. It is None if no run is going on.
+    _now:
+        The minute of the current run, since EPOCH.
+    _ride_index:
+        The index of all_rides by start and end time, or None if it has not
+        been built yet. The times of a list of rides are indexed in
+        microseconds since EPOCH, and those of a RideTable in minutes.
+    _indexed_rides:
+        The all_rides that _ride_index was built for. The index is built
+        again if all_rides is replaced, its length changes, or
+        rides_changed is called.
+    _record_occupancy:
+        Whether this simulation records occupancy.
+    _recorder:
+        The history where the changes of the stations are recorded during
+        the current run, or None if no run is going on or this simulation
+        does not record occupancy.
     """
     all_stations: Dict[str, Station]
-    all_rides: List[Ride]
-    visualizer: Visualizer
-    active_rides: List[Ride]
+    all_rides: Union[List[Ride], RideTable]
+    visualizer: Optional[Visualizer]
     priorityqueue: PriorityQueue
-
-    def __init__(self, station_file: str, ride_file: str) -> None:
+    instruments: Optional[Instruments]
+    occupancy: Optional[OccupancyHistory]
+    _active_rides: Dict[Union[Ride, int], None]
+    _ended_rides: List[Union[Ride, int]]
+    _rides_by_start: Dict[Union[datetime, int], List]
+    _rides_by_end: Dict[Union[datetime, int], List]
+    _start_rows: np.ndarray
+    _start_minutes: np.ndarray
+    _next_start: int
+    _stations: List[Station]
+    _pending_minutes: PriorityQueue
+    _drawn_rides: Dict[int, Ride]
+    _station_group: StationGroup
+    _leaderboards: Optional[Dict[str, Leaderboard]]
+    _ride_file: Optional[str]
+    _ride_stream: Optional[Iterator[Ride]]
+    _next_ride: Optional[Ride]
+    _frame_dir: Optional[str]
+    _frame_workers: Optional[int]
+    _initial_group: StationGroup
+    _resume_rides: Optional[List[int]]
+    _ride_positions: Optional[Dict[Ride, int]]
+    _credited: Optional[np.ndarray]
+    _now: int
+    _ride_index: Optional[RideIndex]
+    _indexed_rides: Union[List[Ride], RideTable, None]
+    _record_occupancy: bool
+    _recorder: Optional[OccupancyHistory]
+
+    def __init__(self, station_file: str, ride_file: str,
+                 headless: bool = False, columnar: bool = False,
+                 streaming: bool = False,
+                 cache_dir: Optional[str] = None,
+                 live_stats: bool = False,
+                 frame_dir: Optional[str] = None,
+                 frame_workers: Optional[int] = None,
+                 instrument: bool = False,
+                 record_occupancy: bool = False) -> None:
         """Initialize this simulation with the given configuration settings.
-        """
-        self.visualizer = Visualizer()
-        self.all_stations = create_stations(station_file)
-        self.all_rides = create_rides(ride_file, self.all_stations)
-        self.active_rides = []
-        self.priorityqueue = PriorityQueue()
 
-    def run(self, start: datetime, end: datetime) -> None:
+        If <headless> is True, no pygame window is opened: nothing is
+        rendered while the simulation runs, and run() returns as soon as
+        the simulation time period is over.
+
+        If <columnar> is True, the rides are loaded into a RideTable instead
+        of a list of Ride objects, and Ride objects are only created for
+        the active rides that are drawn.
+
+        If <streaming> is True, the rides are not loaded at all. Instead,
+        each run reads <ride_file> again, and only keeps the rides that are
+        about to start or are active in memory. <ride_file> must then list
+        the rides in order of start time.
+
+        If <cache_dir> is not None, the parsed stations and rides are kept
+        in that directory, and read back from it instead of parsing the data
+        files again for as long as the files do not change. The rides of a
+        streaming simulation are always read from <ride_file>.
+
+        If <live_stats> is True, the statistics of calculate_statistics are
+        kept in leaderboards, so that they can be read in O(log n) amortized
+        time, for n stations. A station's leaderboards are updated, in
+        O(log n) time each, when its number of bikes changes and when its
+        tla/tlu are credited (see run), so during a run the tla/tlu of the
+        leaderboards only count the time up to each station's last change.
+        They are complete once the run is over. Only the changes made by
+        the simulation itself are followed.
+
+        If <frame_dir> is not None, no pygame window is opened either.
+        Instead, the frames are rendered off-screen and saved in <frame_dir>
+        as numbered PNG images by <frame_workers> worker processes, or one
+        per CPU if <frame_workers> is None. Each run saves its frames from
+        frame000000.png on, and returns once they are all saved.
+
+        If <instrument> is True, the time spent in each phase of the
+        simulation and the work done are measured in instruments, over the
+        creation of this simulation and all its runs: reading the data
+        files and preparing the rides of each run ('ingestion'), processing
+        the rides ('events', which includes reading the rides file of a
+        streaming simulation), the tla/tlu accounting ('statistics') and
+        rendering and exporting frames ('rendering'). The counters are the
+        number of ride starts and ends processed ('events'), the numbers of
+        them that were ignored because the station was empty
+        ('ignored_starts') or full ('ignored_ends'), the number of frames
+        rendered ('frames') and the largest number of pending events or
+        minutes at any moment of a run ('queue_high_water'). The queues are
+        measured right after they are filled and after every event or
+        minute added to them, in the runs that process the rides from them:
+        runs that skip idle minutes, and all runs of columnar and streaming
+        simulations. Other runs leave queue_high_water unchanged.
+
+        If <record_occupancy> is True, the number of bikes at every station
+        throughout each run is recorded in occupancy, which can then be
+        queried over any part of the run.
+
+        Raise ValueError if both <columnar> and <streaming> are True, or if
+        <headless> is True and <frame_dir> is not None.
+        """
+        if columnar and streaming:
+            raise ValueError('a simulation cannot be both columnar and '
+                             'streaming')
+        if headless and frame_dir is not None:
+            raise ValueError('a headless simulation cannot export frames')
+        if headless:
+            self.visualizer = None
+        else:
+            self.visualizer = Visualizer(offscreen=frame_dir is not None)
+        self._frame_dir = frame_dir
+        self._frame_workers = frame_workers
+        self._resume_rides = None
+        self._ride_positions = None
+        self._credited = None
+        self._now = 0
+        self.occupancy = None
+        self._ride_index = None
+        self._indexed_rides = None
+        self._record_occupancy = record_occupancy
+        self._recorder = None
+        self.instruments = Instruments() if instrument else None
+        loading_start = perf_counter()
+        if cache_dir is None:
+            self.all_stations = create_stations(station_file)
+        else:
+            self.all_stations = cached_stations(station_file, cache_dir,
+                                                create_stations)
+        self._station_group = group_stations(list(self.all_stations.values()))
+        if self.visualizer is not None:
+            self.visualizer.set_stations(list(self.all_stations.values()))
+        self._initial_group = StationGroup(
+            self._station_group.capacity.tolist(),
+            self._station_group.num_bikes.tolist(),
+            self._station_group.tla.tolist(), self._station_group.tlu.tolist())
+        self._leaderboards = self._create_leaderboards() if live_stats \
+            else None
+        self._ride_file = ride_file if streaming else None
+        self._ride_stream = None
+        self._next_ride = None
+        if streaming:
+            self.all_rides = []
+            self._stations = []
+        elif columnar:
+            if cache_dir is None:
+                self.all_rides = create_ride_table(ride_file,
+                                                   self.all_stations)
+            else:
+                self.all_rides = cached_ride_table(ride_file,
+                                                   self.all_stations,
+                                                   cache_dir)
+            self._stations = [self.all_stations[id_]
+                              for id_ in self.all_rides.station_ids]
+        elif cache_dir is None:
+            self.all_rides = create_rides(ride_file, self.all_stations)
+            self._stations = []
+        else:
+            table = cached_ride_table(ride_file, self.all_stations, cache_dir)
+            self.all_rides = table.rides(
+                [self.all_stations[id_] for id_ in table.station_ids])
+            self._stations = []
+        if self.instruments is not None:
+            self.instruments.add_time('ingestion',
+                                      perf_counter() - loading_start)
+        self._clear_rides()
+
+    def run(self, start: datetime, end: datetime,
+            skip_idle: bool = False, render_every: int = 1,
+            target_fps: Optional[float] = None,
+            checkpoint_dir: Optional[str] = None,
+            checkpoint_every: timedelta = timedelta(days=1)) -> None:
         """Run the simulation from <start> to <end>.
 
+        If <skip_idle> is True, the simulation is driven by the events in
+        priorityqueue: instead of stepping one minute at a time, each
+        iteration jumps straight to the minute of the next event (or to
+        <end>), and the skipped minutes are credited to every station's
+        tla/tlu in one step. Nothing changes at any station between two
+        events, so this produces the same results as stepping minute by
+        minute through the same events, while the number of iterations only
+        depends on the number of events. The visualization is only rendered
+        at the minutes that are visited.
+
+        The tla/tlu of a station are not credited minute by minute either,
+        even if this simulation keeps live statistics. Each station is
+        credited with the minutes since its last change right before its
+        number of bikes changes, and all the stations are credited with
+        their remaining minutes once the run reaches <end>, so the cost of
+        the statistics depends on the number of events, not on the number
+        of stations times the number of minutes.
+
+        If all_rides is a RideTable, the rides are processed from the table
+        by _update_active_table_rides, with the same results. If this
+        simulation is streaming, the rides are read from its rides file as
+        the simulation time reaches their start times, and processed as
+        events, with the same results too.
+
+        The visualization is only rendered at every <render_every>th visited
+        minute, starting with <start>. If <target_fps> is not None, a frame
+        is also skipped unless at least 1 / <target_fps> seconds of real
+        time have passed since the last one, so the simulation runs as fast
+        as it can between frames. The last visited minute is always
+        rendered. Rendering less often does not change the statistics.
+
+        If <checkpoint_dir> is not None, a checkpoint of the simulation is
+        saved there, by save_checkpoint, at every minute of the run that is
+        a whole multiple of <checkpoint_every> since EPOCH, e.g. at every
+        midnight. The file of the checkpoint of a time is named after it,
+        following CHECKPOINT_FILE. Those minutes are always visited, even
+        when <skip_idle> is True.
+
+        If load_checkpoint was called since the last run, this run continues
+        the simulation from the checkpoint: the rides that were active then
+        are active at <start>, instead of the rides that are on the way at
+        <start>.
+
+        Raise ValueError if <render_every> is less than 1, if <target_fps>
+        or <checkpoint_every> is not positive, if <checkpoint_dir> is not
+        None and this simulation is streaming, or if this simulation is
+        streaming and its rides file is not in order of start time.
+
         === Representation Invariant ===
-        - Time step for each iteration in simulation run is fixed to 1 minute.
+        - Time step for each iteration in simulation run is fixed to 1 minute,
+          unless <skip_idle> is True.
         - The parameter <start> is smaller than <end>
 
         === Precondition ===
@@ -74,9 +393,346 @@ class Simulation:
                  datetime_variable.microsecond == 0
         - Ride's start time is smaller than its end time
         """
+        if render_every < 1:
+            raise ValueError('render_every must be at least 1')
+        if target_fps is not None and target_fps <= 0:
+            raise ValueError('target_fps must be positive')
+        if checkpoint_every <= timedelta(0):
+            raise ValueError('checkpoint_every must be positive')
+        if checkpoint_dir is not None and self._ride_file is not None:
+            raise ValueError('a streaming simulation has no checkpoints')
         current_time = start
         step = timedelta(minutes=1)  # Each iteration spans one minute of time
+        steps = 0  # Number of minutes visited so far
+        last_frame = None  # Real time when the last frame was rendered
+
+        prepare_run = self._prepare_run
+        render = self._render
+        instruments = self.instruments
+        if instruments is not None:
+            prepare_run = instruments.timed('ingestion', prepare_run)
+            render = instruments.timed('rendering', render)
+        # The rides file of a streaming run is closed, and the workers saving
+        # exported frames are stopped, even if the run fails.
+        frames = None
+        try:
+            update = prepare_run(start, end, skip_idle)
+            if instruments is not None:
+                update = instruments.timed('events', update)
+
+            # Each station's tla and tlu are only credited when its number
+            # of bikes changes, and once at <end>.
+            self._credited = np.full(len(self.all_stations), to_minute(start),
+                                     dtype=np.int64)
+            if self._record_occupancy:
+                self.occupancy = self._recorder = OccupancyHistory(
+                    list(self.all_stations),
+                    self._station_group.num_bikes.tolist(),
+                    to_minute(start))
+            if self._frame_dir is not None:
+                frames = FrameWriter(self._frame_dir, SCREEN_SIZE,
+                                     self._frame_workers)
+
+            while current_time <= end:  # start_time & end_time inclusive
+                if checkpoint_dir is not None:
+                    # Time since the last checkpoint time, which may be this
+                    # one.
+                    since_checkpoint = \
+                        (current_time - EPOCH) % checkpoint_every
+                    if not since_checkpoint:
+                        self.save_checkpoint(
+                            os.path.join(
+                                checkpoint_dir,
+                                current_time.strftime(CHECKPOINT_FILE)),
+                            current_time)
+
+                self._now = to_minute(current_time)
+                update(current_time)
+                if skip_idle:
+                    next_time = self._next_event_time(current_time, end)
+                    if checkpoint_dir is not None:
+                        next_time = min(next_time, current_time +
+                                        checkpoint_every - since_checkpoint)
+                else:
+                    next_time = current_time + step
+
+                if self.visualizer is not None and (
+                        next_time > end or
+                        (steps % render_every == 0 and
+                         (target_fps is None or last_frame is None or
+                          perf_counter() - last_frame >= 1 / target_fps))):
+                    render(current_time, frames)
+                    last_frame = perf_counter()
+                current_time = next_time
+                steps += 1
+
+            if instruments is not None:
+                instruments.timed('statistics', self._credit_stations)(
+                    to_minute(end))
+            else:
+                self._credit_stations(to_minute(end))
+            self._credited = None
+            if self._recorder is not None:
+                self._recorder.finish(to_minute(end))
+                self._recorder = None
+            if frames is not None:
+                writer, frames = frames, None
+                if instruments is not None:
+                    instruments.timed('rendering', writer.close)()
+                else:
+                    writer.close()
+        finally:
+            if self._ride_stream is not None:
+                self._ride_stream.close()
+                self._ride_stream = self._next_ride = None
+            if frames is not None:
+                frames.close()
+
+        if self._frame_dir is not None:
+            return  # Exported: there is no window to keep open.
+        if self.visualizer is None:
+            return  # Headless: there is no window to keep open.
+
+        # The code below will keep the visualization window open until you
+        # close it by pressing the 'X'.
+        while True:
+            if self.visualizer.handle_window_events():
+                return  # Stop the simulation
+
+    def rides_changed(self) -> None:
+        """Record that all_rides was changed in place, so that the indexes
+        of the rides are built again before the next run.
+
+        Replacing all_rides with another list or RideTable needs no call.
+        """
+        self._ride_index = None
+        self._ride_positions = None
+
+    def reset(self, stations: Optional[Dict[str, Tuple[int, int]]] = None
+              ) -> None:
+        """Forget all the earlier runs of this simulation, so that the next
+        run starts from the state this simulation was created in.
+
+        Every station gets back its original capacity and number of bikes,
+        and its statistics are set to zero. There are no active rides or
+        pending events left.
+
+        <stations> maps the ids of some stations to the (capacity, number
+        of bikes) they should have instead of their original ones.
+
+        Precondition: 0 <= number of bikes <= capacity for every station in
+        <stations>.
+        """
+        group = self._station_group
+        group.capacity[:] = self._initial_group.capacity
+        group.num_bikes[:] = self._initial_group.num_bikes
+        group.tla[:] = self._initial_group.tla
+        group.tlu[:] = self._initial_group.tlu
+        for station in self.all_stations.values():
+            station.start = station.end = 0
+        for id_, (capacity, num_bikes) in (stations or {}).items():
+            self.all_stations[id_].capacity = capacity
+            self.all_stations[id_].num_bikes = num_bikes
+        if self._leaderboards is not None:
+            self._leaderboards = self._create_leaderboards()
+
+        self._clear_rides()
+        self._resume_rides = None
+
+    def _clear_rides(self) -> None:
+        """Forget the active rides and the pending events of the last run.
+        """
+        self._active_rides = {}
+        self._ended_rides = []
+        self.priorityqueue = PriorityQueue(Event.key)
+        self._rides_by_start = {}
+        self._rides_by_end = {}
+        self._start_rows = self._start_minutes = np.empty(0, dtype=np.int64)
+        self._next_start = 0
+        self._pending_minutes = PriorityQueue()
+        self._drawn_rides = {}
+
+    def _render(self, time: datetime, frames: Optional[FrameWriter]) -> None:
+        """Render the stations and active rides of this simulation at <time>,
+        and give the frame to <frames> if it is not None.
+
+        The stations were given to the visualizer by set_stations when this
+        simulation was created, and it draws the ones in view itself, so
+        only the active rides are passed to render_drawables.
+        """
+        self.visualizer.render_drawables(self._active_drawables(), time)
+        if frames is not None:
+            frames.write(self.visualizer.frame())
+        if self.instruments is not None:
+            self.instruments.count('frames')
+
+    def _prepare_run(self, start: datetime, end: datetime,
+                     skip_idle: bool) -> Callable[[datetime], None]:
+        """Prepare the rides for a run of this simulation from <start> to
+        <end>, and return the method that updates the active rides at each
+        minute of the run.
+
+        The active rides and pending events of any earlier run are dropped
+        first: each run starts from the rides on the way at <start>, or
+        from the rides of the checkpoint that was loaded.
+        """
+        self._clear_rides()
+        if isinstance(self.all_rides, RideTable):
+            self._load_ride_table(start, end)
+            update = self._update_active_table_rides
+        elif self._ride_file is not None:
+            self._open_ride_stream(start)
+            update = self._update_streamed_rides
+        else:
+            self._load_rides(start, end, skip_idle)
+            if not skip_idle:
+                # The rides are not processed from priorityqueue.
+                return self._update_active_rides
+            update = self._update_active_rides_fast
+        if self.instruments is not None:
+            self._measure_queues()
+        return update
+
+    def _measure_queues(self) -> None:
+        """Raise the 'queue_high_water' counter of instruments to the number
+        of events in priorityqueue and minutes in _pending_minutes.
+
+        Precondition: instruments is not None.
+        """
+        self.instruments.high_water('queue_high_water',
+                                    len(self.priorityqueue) +
+                                    len(self._pending_minutes))
+
+    def save_checkpoint(self, path: str, time: datetime) -> None:
+        """Save the state of this simulation at <time> in the file <path>.
+
+        The state is saved as it is before the rides that start or end at
+        <time> are processed: the number of bikes, capacity and statistics
+        of every station, the number of rides in all_rides, and the
+        positions in all_rides of the active rides. It is saved in NumPy's
+        compressed .npz format, and its directory is created if it does not
+        exist.
 
+        Raise ValueError if this simulation is streaming.
+        """
+        if self._ride_file is not None:
+            raise ValueError('a streaming simulation has no checkpoints')
+        if self._credited is not None:
+            self._credit_stations(to_minute(time))
+        active = self._active_positions()
+        stations = list(self.all_stations.values())
+        group = self._station_group
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'wb') as file:
+            np.savez_compressed(
+                file, minute=to_minute(time),
+                station_ids=np.array(list(self.all_stations), dtype=str),
+                capacity=group.capacity, num_bikes=group.num_bikes,
+                tla=group.tla, tlu=group.tlu,
+                start=np.array([s.start for s in stations], dtype=np.int64),
+                end=np.array([s.end for s in stations], dtype=np.int64),
+                ride_count=len(self.all_rides),
+                active=np.array(active, dtype=np.int64))
+
+    def _active_positions(self) -> List[int]:
+        """Return the positions in all_rides of the active rides, in the
+        order they became active.
+
+        The rides that have already ended are removed from the active rides
+        first.
+        """
+        self._drop_ended_rides()
+        if isinstance(self.all_rides, RideTable):
+            return list(self._active_rides)
+        if self._ride_positions is None:
+            self._ride_positions = {ride: i
+                                    for i, ride in enumerate(self.all_rides)}
+        return [self._ride_positions[ride] for ride in self._active_rides]
+
+    def load_checkpoint(self, path: str) -> datetime:
+        """Restore the state of this simulation from the checkpoint in the
+        file <path>, and return the time of the checkpoint.
+
+        The next run continues the simulation from that state, as if it
+        were the part of the run that saved the checkpoint from its time
+        on. It must be a run of the same simulation data.
+
+        Raise ValueError if this simulation is streaming, or if the
+        checkpoint was saved by a simulation of other stations or of another
+        number of rides.
+        """
+        if self._ride_file is not None:
+            raise ValueError('a streaming simulation has no checkpoints')
+        with np.load(path) as checkpoint:
+            if checkpoint['station_ids'].tolist() != list(self.all_stations):
+                raise ValueError('the checkpoint is for other stations')
+            if 'ride_count' not in checkpoint.files or \
+                    int(checkpoint['ride_count']) != len(self.all_rides):
+                raise ValueError('the checkpoint is for other rides')
+            self.reset()
+            group = self._station_group
+            group.capacity[:] = checkpoint['capacity']
+            group.num_bikes[:] = checkpoint['num_bikes']
+            group.tla[:] = checkpoint['tla']
+            group.tlu[:] = checkpoint['tlu']
+            for station, start, end in zip(self.all_stations.values(),
+                                           checkpoint['start'].tolist(),
+                                           checkpoint['end'].tolist()):
+                station.start, station.end = start, end
+            self._resume_rides = checkpoint['active'].tolist()
+            time = from_minute(checkpoint['minute'])
+        if self._leaderboards is not None:
+            self._leaderboards = self._create_leaderboards()
+        return time
+
+    def resume(self, checkpoint_dir: str, start: datetime, end: datetime,
+               **options: object) -> None:
+        """Run this simulation from <start> to <end>, starting from the
+        state of the simulation that saved the checkpoints in
+        <checkpoint_dir>, at <start>.
+
+        The latest checkpoint at or before <start> is loaded, and the rides
+        are then processed up to <start>. The statistics of the stations
+        are set to zero at <start>, so that only the run from <start> to
+        <end> is counted. <options> are passed on to run.
+
+        Raise ValueError if there is no checkpoint at or before <start> in
+        <checkpoint_dir>, or for the same reasons as load_checkpoint.
+        """
+        times = []
+        for name in os.listdir(checkpoint_dir):
+            try:
+                times.append(datetime.strptime(name, CHECKPOINT_FILE))
+            except ValueError:
+                continue  # Not a checkpoint file.
+        times = [time for time in times if time <= start]
+        if not times:
+            raise ValueError('there is no checkpoint before the start')
+
+        time = self.load_checkpoint(
+            os.path.join(checkpoint_dir, max(times).strftime(CHECKPOINT_FILE)))
+        if time < start:
+            # Process the rides up to <start>, and go on from there.
+            last = start - timedelta(minutes=1)
+            update = self._prepare_run(time, last, True)
+            while time <= last:
+                update(time)
+                time = self._next_event_time(time, last)
+            self._resume_rides = self._active_positions()
+
+        self._station_group.tla[:] = 0
+        self._station_group.tlu[:] = 0
+        for station in self.all_stations.values():
+            station.start = station.end = 0
+        if self._leaderboards is not None:
+            self._leaderboards = self._create_leaderboards()
+        self.run(start, end, **options)
+
+    def _load_rides(self, start: datetime, end: datetime,
+                    events: bool) -> None:
+        """Prepare the ride indexes for a run of this simulation from <start>
+        to <end>, and the events in priorityqueue too if <events> is True.
+        """
         # 1. Add "ride start" event to priority queue for each ride that occurs
         #    during the simulation time period.
         # 2. Add "ride end" event to priority queue for each ride, where start
@@ -84,36 +740,126 @@ class Simulation:
         #    the simulation time period.
         # It means that events that start outside simulation time period and
         # ends within or outside simulation time period won't be considered.
-        for ride_ in self.all_rides:
-            if start <= ride_.start_time <= end:
-                ride_start_event = RideStartEvent(
-                    self, ride_.start_time, ride_
-                )
-                self.priorityqueue.add(ride_start_event)
-            if (ride_.start_time < start) and (ride_.end_time >= start):
-                ride_end_event = RideEndEvent(
-                    self, ride_.end_time, ride_
-                )
-                self.active_rides.append(ride_)
-                self.priorityqueue.add(ride_end_event)
-
-        while current_time <= end:  # start_time & end_time inclusive
-            self._update_active_rides(current_time)
-            # self._update_active_rides_fast(current_time)
-
-            # availability and low_occupancy are only checked within intervals.
-            if current_time < end:
-                self._update_stat_low_availability_unoccupied()
-
-            render_list = list(self.all_stations.values()) + self.active_rides
-            self.visualizer.render_drawables(render_list, current_time)
-            current_time += step
-
-        # The code below will keep the visualization window open until you
-        # close it by pressing the 'X'.
-        while True:
-            if self.visualizer.handle_window_events():
-                return  # Stop the simulation
+        # The events are collected first and heapified in a single batch.
+        # The same rides are also indexed by time for _update_active_rides.
+        # When resuming from a checkpoint, the rides that were active at the
+        # checkpoint take the place of the rides in step 2.
+        # The rides of both steps are found in the ride index, and taken in
+        # the order of all_rides.
+        index = self._get_ride_index()
+        first = _microseconds(start)
+        initial_events: List[Event] = []
+        for position in index.starting(first, _microseconds(end)).tolist():
+            ride_ = self.all_rides[position]
+            if events:
+                initial_events.append(
+                    RideStartEvent(self, ride_.start_time, ride_))
+            self._rides_by_start.setdefault(
+                ride_.start_time, []).append(ride_)
+        if self._resume_rides is None:
+            straddling = [self.all_rides[i]
+                          for i in index.straddling(first).tolist()]
+        else:
+            straddling = [self.all_rides[i] for i in self._resume_rides]
+            self._resume_rides = None
+
+        for ride_ in straddling:
+            self._active_rides[ride_] = None
+            if events:
+                initial_events.append(
+                    RideEndEvent(self, ride_.end_time, ride_))
+            self._rides_by_end.setdefault(
+                ride_.end_time, []).append(ride_)
+        if events:
+            self.priorityqueue.add_many(initial_events)
+
+    def _load_ride_table(self, start: datetime, end: datetime) -> None:
+        """Prepare the ride indexes for a run of this simulation from <start>
+        to <end>, when all_rides is a RideTable.
+
+        The same rides as in _load_rides are selected from the ride index,
+        or from the checkpoint that is resumed.
+        """
+        table = self.all_rides
+        ride_index = self._get_ride_index()
+        first, last = to_minute(start), to_minute(end)
+
+        self._start_rows = ride_index.starting(first, last, by_time=True)
+        self._start_minutes = table.start_minute[self._start_rows]
+        self._pending_minutes.add_many(np.unique(self._start_minutes).tolist())
+
+        if self._resume_rides is None:
+            straddling = ride_index.straddling(first)
+        else:
+            straddling = np.array(self._resume_rides, dtype=np.int64)
+            self._resume_rides = None
+        for index, end_minute in zip(straddling.tolist(),
+                                     table.end_minute[straddling].tolist()):
+            self._active_rides[index] = None
+            self._add_table_ride_end(index, end_minute)
+
+    def _get_ride_index(self) -> RideIndex:
+        """Return the index of all_rides by start and end time, building it
+        if all_rides is not indexed yet.
+        """
+        if self._ride_index is None or \
+                self._indexed_rides is not self.all_rides or \
+                len(self._ride_index) != len(self.all_rides):
+            if isinstance(self.all_rides, RideTable):
+                self._ride_index = RideIndex(self.all_rides.start_minute,
+                                             self.all_rides.end_minute)
+            else:
+                self._ride_index = RideIndex(
+                    _microseconds([ride.start_time
+                                   for ride in self.all_rides]),
+                    _microseconds([ride.end_time
+                                   for ride in self.all_rides]))
+            self._indexed_rides = self.all_rides
+            self._ride_positions = None
+        return self._ride_index
+
+    def _open_ride_stream(self, start: datetime) -> None:
+        """Start reading the rides file of this streaming simulation for a
+        run from <start>.
+
+        All the rides that start before <start> are read right away, and
+        the ones that are still on the way at <start> become active, as in
+        _load_rides. The first ride that starts at or after <start> is kept
+        in _next_ride. Rides that start after <end> are never read, since
+        run() stops reading the file once it is over.
+
+        The file is read again from its start on every run, so that each
+        run sees the same rides as a run of a simulation that loads them.
+
+        Every ride that is read, before or after <start>, raises ValueError
+        if it starts before the ride that was read before it.
+        """
+        if self._ride_stream is not None:
+            self._ride_stream.close()
+        self._ride_stream = _in_start_order(
+            iter_rides(self._ride_file, self.all_stations))
+        self._next_ride = None
+        initial_events: List[Event] = []
+        for ride_ in self._ride_stream:
+            if ride_.start_time >= start:
+                self._next_ride = ride_
+                break
+            if ride_.end_time >= start:
+                self._active_rides[ride_] = None
+                initial_events.append(RideEndEvent(self, ride_.end_time,
+                                                   ride_))
+        self.priorityqueue.add_many(initial_events)
+
+    def _add_table_ride_end(self, index: int, end_minute: int) -> None:
+        """Record that the ride in row <index> of the RideTable all_rides is
+        active and ends at <end_minute>.
+        """
+        if end_minute not in self._rides_by_end:
+            self._rides_by_end[end_minute] = []
+            self._pending_minutes.add(end_minute)
+            if self.instruments is not None:
+                self._measure_queues()
+        self._rides_by_end[end_minute].append(index)
 
     def _update_active_rides(self, time: datetime) -> None:
         """Update this simulation's list of active_rides and statistics
@@ -138,34 +884,21 @@ class Simulation:
             - If there is no space at a station when a ride ends,
               the ride is removed from active_rides, but the stats
               are not counted.
-        """
 
-        for ride in self.all_rides:
+        Only the rides that start or end at <time> are looked at, and the
+        rides that start at <time> are processed before the rides that end
+        at <time>, in the same order as the events of
+        _update_active_rides_fast.
+        """
+        self._drop_ended_rides()
+        for ride in self._rides_by_start.pop(time, []):
             # If a ride starts when its start station is empty, we should
-            # completely ignore this case. Therefore, remove this ride from
-            # all_rides.
-            if (ride.start.num_bikes <= 0) and \
-                    (ride.start_time <= time <= ride.end_time) and \
-                    (ride not in self.active_rides):
-                # if station is empty
-                self.all_rides.remove(ride)
-                continue
-
-            # Add ride to active_rides when it starts.
-            if (ride.start_time <= time <= ride.end_time) and \
-                    (ride not in self.active_rides):
-                self.active_rides.append(ride)
-            # Remove ride from active_rides when it ends.
-            if (time > ride.end_time) and (ride in self.active_rides):
-                self.active_rides.remove(ride)
-
-            # Stats (start, end, num_bikes)
-            if ride.start_time == time and ride.start.num_bikes > 0:
-                ride.start.start += 1
-                ride.start.num_bikes -= 1
-            if ride.end_time == time and ride.end.num_bikes < ride.end.capacity:
-                ride.end.end += 1
-                ride.end.num_bikes += 1
+            # completely ignore this case.
+            if self.start_ride(ride):
+                self._rides_by_end.setdefault(ride.end_time, []).append(ride)
+
+        for ride in self._rides_by_end.pop(time, []):
+            self.end_ride(ride)
 
     def _update_active_rides_fast(self, time: datetime) -> None:
         """Update this simulation's list of active_rides and statistics
@@ -191,22 +924,213 @@ class Simulation:
               the ride is removed from active_rides, but the stats
               are not counted.
         """
-        # Do nothing if priorityqueue is empty.
         # Iterates through the PQ events until the event time is after
         # the current simulation time. This is to take into account
         # a potential situation where there are 2 events with the
         # same time in the queue.
-        if self.priorityqueue.is_empty():
-            return None
-        while True:
-            event = self.priorityqueue.remove()
-            if time < event.time:
-                self.priorityqueue.add(event)
-                break
+        self._drop_ended_rides()
+        while not self.priorityqueue.is_empty() and \
+                self.priorityqueue.peek().time <= time:
+            self.priorityqueue.remove().process()
+            # An event adds at most one new event to the queue.
+            if self.instruments is not None:
+                self._measure_queues()
+
+    def _update_streamed_rides(self, time: datetime) -> None:
+        """Update this simulation's active_rides and statistics for the given
+        time, when this simulation is streaming.
+
+        The rides that start at <time> are read from the rides file, and
+        their "ride start" events are added to priorityqueue before it is
+        processed by _update_active_rides_fast.
+
+        Raise ValueError if a ride that is read starts before the ride that
+        was read before it.
+        """
+        while self._next_ride is not None and \
+                self._next_ride.start_time <= time:
+            ride = self._next_ride
+            self.priorityqueue.add(RideStartEvent(self, ride.start_time, ride))
+            if self.instruments is not None:
+                self._measure_queues()
+            self._next_ride = next(self._ride_stream, None)
+        self._update_active_rides_fast(time)
+
+    def _update_active_table_rides(self, time: datetime) -> None:
+        """Update this simulation's active_rides and statistics for the given
+        time, when all_rides is a RideTable.
+
+        The rides are processed with the same rules and in the same order
+        as in _update_active_rides, but straight from the columns of the
+        table: no Ride objects are created. The rides that start at <time>
+        are the next ones of _start_rows.
+        """
+        self._drop_ended_rides()
+        table = self.all_rides
+        minute = to_minute(time)
+        while not self._pending_minutes.is_empty() and \
+                self._pending_minutes.peek() <= minute:
+            self._pending_minutes.remove()
+
+        first = self._next_start
+        self._next_start = int(np.searchsorted(self._start_minutes, minute,
+                                               'right'))
+        starting = self._start_rows[first:self._next_start]
+        for index, start_station, end_minute in zip(
+                starting.tolist(), table.start_station[starting].tolist(),
+                table.end_minute[starting].tolist()):
+            if self.take_bike(self._stations[start_station]):
+                self._active_rides[index] = None
+                self._add_table_ride_end(index, end_minute)
+
+        for index in self._rides_by_end.pop(minute, []):
+            self._ended_rides.append(index)
+            self.return_bike(self._stations[int(table.end_station[index])])
+
+    def _drop_ended_rides(self) -> None:
+        """Remove the rides that ended at the last minute that was visited
+        from the active rides.
+        """
+        for ride in self._ended_rides:
+            del self._active_rides[ride]
+        self._ended_rides = []
+
+    @property
+    def active_rides(self) -> List[Ride]:
+        """A new list of the active rides of this simulation, in the order
+        they became active.
+
+        They are Ride objects even if all_rides is a RideTable.
+        """
+        return self._active_drawables()
+
+    def _active_drawables(self) -> List[Ride]:
+        """Return the active rides of this simulation as Ride objects.
+
+        If all_rides is a RideTable, Ride objects are created for the rides
+        that just became active, and kept for as long as they stay active.
+        """
+        if not isinstance(self.all_rides, RideTable):
+            return list(self._active_rides)
+
+        drawn = {}
+        for index in self._active_rides:
+            if index in self._drawn_rides:
+                drawn[index] = self._drawn_rides[index]
+            else:
+                drawn[index] = self.all_rides.ride(index, self._stations)
+        self._drawn_rides = drawn
+        return list(drawn.values())
+
+    def start_ride(self, ride: Ride) -> bool:
+        """Start <ride>, by taking a bike from its start station.
+
+        Return True if the ride could start, and is then active. If the
+        station has no bikes, nothing is changed and False is returned.
+        """
+        if not self.take_bike(ride.start):
+            return False
+        self._active_rides[ride] = None
+        return True
+
+    def end_ride(self, ride: Ride) -> bool:
+        """End the active <ride>, by returning its bike to its end station.
+
+        The ride stays active until the next minute that is visited, so
+        that it is still drawn at its end time. Return whether the ride's
+        end was counted, as return_bike does.
+        """
+        self._ended_rides.append(ride)
+        return self.return_bike(ride.end)
+
+    def take_bike(self, station: Station) -> bool:
+        """Take a bike from <station> for a ride that starts there.
+
+        Return True if the ride could start. If <station> has no bikes,
+        nothing is changed and False is returned.
+        """
+        if self.instruments is not None:
+            self.instruments.count('events')
+        if station.num_bikes <= 0:
+            if self.instruments is not None:
+                self.instruments.count('ignored_starts')
+            return False
+        if self._credited is not None:
+            if self.instruments is not None:
+                self.instruments.timed('statistics', self._credit_station)(
+                    station.index)
+            else:
+                self._credit_station(station.index)
+        station.start += 1
+        station.num_bikes -= 1
+        if self._recorder is not None:
+            self._recorder.record(station.index, self._now,
+                                  station.num_bikes)
+        if self._leaderboards is not None:
+            self._leaderboards['max_start'].update(station.index,
+                                                   station.start)
+        return True
+
+    def return_bike(self, station: Station) -> bool:
+        """Return a bike to <station> for a ride that ends there.
+
+        Return True if the ride's end was counted. If <station> has no
+        free spots, nothing is changed and False is returned.
+        """
+        if self.instruments is not None:
+            self.instruments.count('events')
+        if station.num_bikes >= station.capacity:
+            if self.instruments is not None:
+                self.instruments.count('ignored_ends')
+            return False
+        if self._credited is not None:
+            if self.instruments is not None:
+                self.instruments.timed('statistics', self._credit_station)(
+                    station.index)
             else:
-                event.process()
-                if self.priorityqueue.is_empty():
-                    break
+                self._credit_station(station.index)
+        station.end += 1
+        station.num_bikes += 1
+        if self._recorder is not None:
+            self._recorder.record(station.index, self._now,
+                                  station.num_bikes)
+        if self._leaderboards is not None:
+            self._leaderboards['max_end'].update(station.index, station.end)
+        return True
+
+    def _next_event_time(self, time: datetime, end: datetime) -> datetime:
+        """Return the next time that the simulation has to visit after <time>,
+        when it is run from events only.
+
+        This is the time of the next event in priorityqueue, rounded up to
+        the one-minute grid that starts at <time>, but never later than
+        <end>. Once <time> has reached <end>, the time one minute after it
+        is returned so that the run can stop.
+
+        === Precondition ===
+        - every event in priorityqueue, every minute in _pending_minutes,
+          and _next_ride, happen after <time>.
+        """
+        step = timedelta(minutes=1)
+        if time >= end:
+            return time + step
+
+        if isinstance(self.all_rides, RideTable):
+            if self._pending_minutes.is_empty():
+                return end
+            event_time = from_minute(self._pending_minutes.peek())
+        else:
+            pending = [] if self.priorityqueue.is_empty() \
+                else [self.priorityqueue.peek().time]
+            if self._next_ride is not None:
+                pending.append(self._next_ride.start_time)
+            if not pending:
+                return end
+            event_time = min(pending)
+
+        # -(a // b) rounds the number of minutes until the event up.
+        minutes = -((time - event_time) // step)
+        return min(end, time + max(1, minutes) * step)
 
     def calculate_statistics(self) -> Dict[str, Tuple[str, float]]:
         """Return a dictionary containing statistics for this simulation.
@@ -226,7 +1150,16 @@ class Simulation:
         For example, the value corresponding to key 'max_start' should be the
         name of the station with the most number of rides started at that
         station, and the number of rides that started at that station.
+
+        If this simulation keeps live statistics, they are read from its
+        leaderboards in O(log n) amortized time, for n stations. The
+        leaderboards are kept up to date by the run instead, at a cost of
+        O(log n) for each change of a station and for each station that is
+        credited at the end of the run.
         """
+        if self._leaderboards is not None:
+            return {key: board.leader()
+                    for key, board in self._leaderboards.items()}
 
         # initialization of finding maximum values.
         # max_tla for max_time_low_availability
@@ -268,30 +1201,160 @@ class Simulation:
                 sorted(list_max_tlu)[0], max_tlu)
         }
 
-    def _update_stat_low_availability_unoccupied(self) -> None:
+    def _update_stat_low_availability_unoccupied(self,
+                                                 minutes: int = 1) -> None:
         """ A helper method for calculating statistics.
 
+        Credit <minutes> minutes of the current state of every station.
+
         It changes stats for
             - 'max_start': No
             - 'max_end': No
             - 'max_time_low_availability': Yes
             - 'max_time_low_unoccupied': Yes
 
-        - 'tla' attribute of station is incremented by 60 seconds if the
-          station has at most five bikes available at a given time.
-        - 'tlu' attribute of station is incremented by 60 seconds if the
-           station has at most five spaces available at a given time.
+        - 'tla' attribute of station is incremented by 60 seconds per minute
+          if the station has at most five bikes available at a given time.
+        - 'tlu' attribute of station is incremented by 60 seconds per minute
+           if the station has at most five spaces available at a given time.
+
+        All the stations are updated at once, through the arrays of their
+        StationGroup.
         """
-        for id_ in self.all_stations:
-            station = self.all_stations[id_]
+        seconds = 60 * minutes  # 1 minute -> 60 second
+        group = self._station_group
+
+        # time_low_availability
+        low_availability = group.num_bikes <= 5
+        group.tla[low_availability] += seconds
+
+        # time_low_unoccupied
+        low_unoccupied = (group.capacity - group.num_bikes) <= 5
+        group.tlu[low_unoccupied] += seconds
+
+        if self._leaderboards is not None:
+            for key, low, totals in [
+                    ('max_time_low_availability', low_availability, group.tla),
+                    ('max_time_low_unoccupied', low_unoccupied, group.tlu)]:
+                board = self._leaderboards[key]
+                indices = np.flatnonzero(low)
+                for index, total in zip(indices.tolist(),
+                                        totals[indices].tolist()):
+                    board.update(index, total)
+
+    def _credit_station(self, index: int) -> None:
+        """Credit the tla and tlu of the station at <index> in _station_group
+        with the minutes from the last time they were credited to the
+        current minute of the run, during which its state did not change.
+
+        It is called right before the number of bikes of the station
+        changes, with the same rules as
+        _update_stat_low_availability_unoccupied. The station's tla and tlu
+        leaderboards are updated too, if this simulation keeps live
+        statistics.
+        """
+        minutes = self._now - int(self._credited[index])
+        if minutes > 0:
+            group = self._station_group
+            num_bikes = int(group.num_bikes[index])
+            if num_bikes <= 5:
+                group.tla[index] += 60 * minutes
+                if self._leaderboards is not None:
+                    self._leaderboards['max_time_low_availability'].update(
+                        index, int(group.tla[index]))
+            if int(group.capacity[index]) - num_bikes <= 5:
+                group.tlu[index] += 60 * minutes
+                if self._leaderboards is not None:
+                    self._leaderboards['max_time_low_unoccupied'].update(
+                        index, int(group.tlu[index]))
+            self._credited[index] = self._now
+
+    def _credit_stations(self, minute: int) -> None:
+        """Credit the tla and tlu of every station with the minutes from the
+        last time they were credited to <minute>, since EPOCH, during which
+        its state did not change.
+
+        If this simulation keeps live statistics, the tla and tlu
+        leaderboards of the stations that were credited are updated too.
+        """
+        group = self._station_group
+        seconds = 60 * (minute - self._credited)
+        low_availability = group.num_bikes <= 5
+        group.tla[low_availability] += seconds[low_availability]
+        low_unoccupied = (group.capacity - group.num_bikes) <= 5
+        group.tlu[low_unoccupied] += seconds[low_unoccupied]
+        self._credited[:] = minute
+        if self._leaderboards is not None:
+            for key, low, totals in [
+                    ('max_time_low_availability', low_availability, group.tla),
+                    ('max_time_low_unoccupied', low_unoccupied, group.tlu)]:
+                board = self._leaderboards[key]
+                indices = np.flatnonzero(low & (seconds > 0))
+                for index, total in zip(indices.tolist(),
+                                        totals[indices].tolist()):
+                    board.update(index, total)
+
+    def _create_leaderboards(self) -> Dict[str, Leaderboard]:
+        """Return a Leaderboard for each statistic of calculate_statistics,
+        from the current state of the stations.
+        """
+        stations = list(self.all_stations.values())
+        names = {station.index: station.name for station in stations}
+        return {
+            'max_start': Leaderboard(
+                names, {s.index: s.start for s in stations}),
+            'max_end': Leaderboard(
+                names, {s.index: s.end for s in stations}),
+            'max_time_low_availability': Leaderboard(
+                names, {s.index: s.tla for s in stations}),
+            'max_time_low_unoccupied': Leaderboard(
+                names, {s.index: s.tlu for s in stations})
+        }
+
+    def top_statistics(self, k: int) -> Dict[str, List[Tuple[str, float]]]:
+        """Return the <k> stations with the largest value of each statistic
+        of calculate_statistics.
+
+        Each key of the returned dictionary is a key of calculate_statistics,
+        and its value is a list of the names and values of the stations with
+        the largest values, in decreasing order of value and then increasing
+        order of name.
 
-            # time_low_availability
-            if station.num_bikes <= 5:
-                station.tla += 60  # 1 minute -> 60 second
+        This takes O(k log n) time, for n stations, if this simulation
+        keeps live statistics.
+        """
+        boards = self._leaderboards
+        if boards is None:
+            boards = self._create_leaderboards()
+        return {key: board.top(k) for key, board in boards.items()}
+
+
+def _microseconds(times: Union[datetime, List[datetime]]
+                  ) -> Union[int, np.ndarray]:
+    """Return <times>, a time or a list of times, in whole microseconds
+    since EPOCH.
+    """
+    if isinstance(times, datetime):
+        return (times - EPOCH) // timedelta(microseconds=1)
+    return np.array(times, dtype='datetime64[us]').astype(np.int64)
 
-            # time_low_unoccupied
-            if (station.capacity - station.num_bikes) <= 5:
-                station.tlu += 60  # 1 minute -> 60 second
+
+def _in_start_order(rides: Iterator[Ride]) -> Iterator[Ride]:
+    """Return an iterator over the rides of the generator <rides>, which
+    raises ValueError as soon as a ride starts before the ride before it.
+
+    <rides> is closed when the returned iterator is closed.
+    """
+    last_start = None
+    try:
+        for ride in rides:
+            if last_start is not None and ride.start_time < last_start:
+                raise ValueError('the rides file is not in order of start '
+                                 'time')
+            last_start = ride.start_time
+            yield ride
+    finally:
+        rides.close()
 
 
 def create_stations(stations_file: str) -> Dict[str, 'Station']:
@@ -337,26 +1400,39 @@ def create_rides(rides_file: str,
     === Precondition ===
     rides_file matches the format specified in the assignment handout.
     """
-    rides = []
+    return list(iter_rides(rides_file, stations))
+
+
+def iter_rides(rides_file: str,
+               stations: Dict[str, 'Station']) -> Iterator['Ride']:
+    """Return an iterator over the rides described in the given CSV file.
+
+    The rides are read one at a time, in the order of the file, and are
+    looked up in <stations> as in create_rides.
+
+    === Precondition ===
+    rides_file matches the format specified in the assignment handout.
+    """
+    parser = TimestampParser()
     with open(rides_file) as file:
         for line in csv.reader(file):
             # line is a list of strings, following the format described
             # in the assignment handout.
             #
             # Convert between a string and a datetime object
-            # using the function datetime.strptime and the DATETIME_FORMAT
-            # constant we defined above. Example:
+            # using a TimestampParser, which gives the same result as the
+            # function datetime.strptime and the DATETIME_FORMAT
+            # constant. Example:
             # >>> datetime.strptime('2017-06-01 8:00', DATETIME_FORMAT)
             # datetime.datetime(2017, 6, 1, 8, 0)
             if line[1] in stations and line[3] in stations:
-                t_start = datetime.strptime(line[0], DATETIME_FORMAT)
-                t_end = datetime.strptime(line[2], DATETIME_FORMAT)
+                t_start = parser.parse(line[0])
+                t_end = parser.parse(line[2])
 
                 rd = Ride(
                     stations[line[1]], stations[line[3]], (t_start, t_end)
                 )
-                rides.append(rd)
-    return rides
+                yield rd
 
 
 class Event:
@@ -374,30 +1450,50 @@ class Event:
         Time that the event occurs.
     ride:
         An instance of class Ride. The event occurs when a ride starts or ends.
+    priority:
+        Events that occur at the same time are ordered by priority, so that
+        ride starts come before ride ends.
     """
 
+    __slots__ = ('simulation', 'time', 'ride')
     simulation: 'Simulation'
     time: datetime
     ride: Optional['Ride']
+    priority: int = 0
 
     def __init__(self, simulation: 'Simulation', time: datetime) -> None:
         """Initialize a new event."""
         self.simulation = simulation
         self.time = time
+        self.ride = None
 
     def __lt__(self, other: 'Event') -> bool:
         """Return whether this event is less than <other>.
 
-        Events are ordered by their timestamp.
+        Events are ordered by their timestamp, and then by their priority.
         """
-        return self.time < other.time
+        if self.time != other.time:
+            return self.time < other.time
+        return self.priority < other.priority
+
+    def key(self) -> Tuple[datetime, int]:
+        """Return the time and priority of this event, which order events
+        the same way as '<'.
+
+        A PriorityQueue of events uses this as its key function: the keys
+        are tuples of built-in values, so the queue compares them without
+        calling any Python method.
+        """
+        return self.time, self.priority
 
     def __le__(self, other: 'Event') -> bool:
         """Return whether this event is less than or equal to <other>.
 
-        Events are ordered by their timestamp.
+        Events are ordered by their timestamp, and then by their priority.
         """
-        return self.time <= other.time
+        if self.time != other.time:
+            return self.time < other.time
+        return self.priority <= other.priority
 
     def process(self) -> List['Event']:
         """Process this event by updating the state of the simulation.
@@ -422,19 +1518,14 @@ class RideStartEvent(Event):
     ride:
         An instance of class Ride. This RideStartEvent occurs when a ride
         starts from its stating station.
-    end_event:
-        An instance of class RideEndEvent. It is initiated and passed to
-        priority queue of simulation when process method is called.
-
     """
-    end_event: 'Event'
+    __slots__ = ()
 
     def __init__(self, simulation: 'Simulation', time: datetime,
                  ride: 'Ride' = None) -> None:
         """Initialize a new event."""
         Event.__init__(self, simulation, time)
         self.ride = ride
-        self.end_event = RideEndEvent(simulation, ride.end_time, ride)
 
     def process(self) -> List['Event']:
         """
@@ -445,20 +1536,19 @@ class RideStartEvent(Event):
         Finally, change some statistics.
 
         Return a list of new events spawned by this event. List is empty
-        if there are no new events.
+        if there are no new events: the RideEndEvent is only created if
+        the ride could start.
 
         === Precondition ===
         ride is not None
         """
         list_new_event = []
         # Stats (start, num_bikes)
-        station = self.ride.start
-        if station.num_bikes > 0:
-            station.start += 1
-            station.num_bikes -= 1
-            self.simulation.priorityqueue.add(self.end_event)
-            self.simulation.active_rides.append(self.ride)
-        list_new_event.append(self.end_event)
+        if self.simulation.start_ride(self.ride):
+            end_event = RideEndEvent(self.simulation, self.ride.end_time,
+                                     self.ride)
+            self.simulation.priorityqueue.add(end_event)
+            list_new_event.append(end_event)
         return list_new_event
 
 
@@ -477,7 +1567,12 @@ class RideEndEvent(Event):
     ride:
         An instance of class Ride. This RideEndEvent occurs when a ride
         ends at its ending station.
+    priority:
+        Always 1, so that a ride end is processed after the ride starts
+        that occur at the same time.
     """
+    __slots__ = ()
+    priority: int = 1
 
     def __init__(self, simulation: 'Simulation', time: datetime,
                  ride: 'Ride' = None) -> None:
@@ -488,8 +1583,8 @@ class RideEndEvent(Event):
         """
         Process this event and update the state of the simulation.
 
-        Remove ride attribute from active_rides list of simulation.
-        And change some statistics.
+        Remove ride attribute from active_rides list of simulation, from
+        the next minute on. And change some statistics.
 
         Return a list of new events spawned by this event. List is empty
         if there are no new events.
@@ -497,25 +1592,23 @@ class RideEndEvent(Event):
         === Precondition ===
         ride is not None
         """
-        self.simulation.active_rides.remove(self.ride)
-
         list_new_event = []
         # Stats (end, num_bikes)
-        station = self.ride.end
-        if station.num_bikes < station.capacity:
-            station.end += 1
-            station.num_bikes += 1
+        self.simulation.end_ride(self.ride)
         return list_new_event
 
 
-def sample_simulation() -> Dict[str, Tuple[str, float]]:
+def sample_simulation(headless: bool = False) -> Dict[str,
+                                                     Tuple[str, float]]:
     """Run a sample simulation. For testing purposes only.
 
+    If <headless> is True, the simulation is run without a pygame window.
+
     Return statistics of simulation in dictionary type.
     For more information about statistics, please refer to
         -> Simulation.calculate_statistics()
     """
-    sim = Simulation('stations.json', 'sample_rides.csv')
+    sim = Simulation('stations.json', 'sample_rides.csv', headless)
     sim.run(datetime(2017, 6, 1, 8, 0, 0),
             datetime(2017, 6, 1, 9, 0, 0))
     return sim.calculate_statistics()
@@ -524,11 +1617,13 @@ def sample_simulation() -> Dict[str, Tuple[str, float]]:
 if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
-        'allowed-io': ['create_stations', 'create_rides'],
+        'allowed-io': ['create_stations', 'iter_rides', 'save_checkpoint'],
         'allowed-import-modules': [
             'doctest', 'python_ta', 'typing',
-            'csv', 'datetime', 'json',
-            'bikeshare', 'container', 'visualizer'
+            'csv', 'datetime', 'json', 'os', 'time', 'numpy',
+            'bikeshare', 'container', 'datacache', 'frameexport',
+            'instruments', 'leaderboard', 'occupancy', 'ridestore',
+            'visualizer'
         ]
     })
     print(sample_simulation())
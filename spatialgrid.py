@@ -0,0 +1,130 @@
+"""Assignment 1 - Spatial grid
+
+=== CSC148 Fall 2017 ===
+Diane Horton and David Liu
+Department of Computer Science,
+University of Toronto
+
+
+=== Module Description ===
+
+This file contains the SpatialGrid class, a uniform grid over a set of
+points that finds the points inside a rectangle without looking at all of
+them. The visualizer uses it to only draw the stations that are in view.
+"""
+import math
+from typing import Tuple
+
+import numpy as np
+
+# The average number of points per cell of a grid.
+POINTS_PER_CELL = 4
+
+
+class SpatialGrid:
+    """A uniform grid of cells over a set of points in the plane.
+
+    Points are identified by their position in the array the grid was built
+    from. The points of each cell are stored together, and the cells of
+    each row of the grid follow each other, so the points of any run of
+    cells in a row are one slice of _order.
+
+    === Attributes ===
+    points:
+        The (x, y) coordinates of each point, one per row.
+
+    === Private Attributes ===
+    _origin:
+        The smallest x and y coordinates of any point.
+    _cell_size:
+        The width and height of each cell.
+    _shape:
+        The number of columns and rows of cells.
+    _order:
+        The positions of the points, sorted by cell, row by row.
+    _offsets:
+        The position in _order where the points of each cell start, with
+        one more entry at the end for the end of the last cell.
+    """
+    points: np.ndarray
+    _origin: Tuple[float, float]
+    _cell_size: Tuple[float, float]
+    _shape: Tuple[int, int]
+    _order: np.ndarray
+    _offsets: np.ndarray
+
+    def __init__(self, points: np.ndarray) -> None:
+        """Initialize a grid over <points>, an array with one (x, y) row per
+        point.
+
+        The grid has about POINTS_PER_CELL points per cell.
+        """
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        count = len(self.points)
+        side = max(1, int(math.sqrt(count / POINTS_PER_CELL)))
+        if count:
+            low = self.points.min(axis=0)
+            high = self.points.max(axis=0)
+        else:
+            low = high = np.zeros(2)
+        self._origin = (float(low[0]), float(low[1]))
+        # A cell is never empty-sized, even if all points share a coordinate.
+        self._cell_size = (max(float(high[0] - low[0]) / side, 1e-12),
+                           max(float(high[1] - low[1]) / side, 1e-12))
+        self._shape = (side, side)
+
+        columns, rows = self._cells(self.points[:, 0], self.points[:, 1])
+        cells = rows * side + columns
+        self._order = np.argsort(cells, kind='stable')
+        self._offsets = np.searchsorted(cells[self._order],
+                                        np.arange(side * side + 1))
+
+    def _cells(self, x: np.ndarray,
+               y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the column and row of the cells of the points (x, y),
+        clamped to the grid.
+        """
+        columns = np.floor((np.asarray(x) - self._origin[0]) /
+                           self._cell_size[0]).astype(np.int64)
+        rows = np.floor((np.asarray(y) - self._origin[1]) /
+                        self._cell_size[1]).astype(np.int64)
+        return (np.clip(columns, 0, self._shape[0] - 1),
+                np.clip(rows, 0, self._shape[1] - 1))
+
+    def query(self, low: Tuple[float, float],
+              high: Tuple[float, float]) -> np.ndarray:
+        """Return the positions of the points with low[0] <= x <= high[0] and
+        low[1] <= y <= high[1], in increasing order.
+
+        >>> grid = SpatialGrid(np.array([[0, 0], [1, 1], [2, 2], [3, 0]]))
+        >>> grid.query((0.5, 0), (3, 1.5)).tolist()
+        [1, 3]
+        """
+        if not len(self.points) or low[0] > high[0] or low[1] > high[1]:
+            return np.empty(0, dtype=np.int64)
+        (first_column, last_column), (first_row, last_row) = \
+            self._cells(np.array([low[0], high[0]]),
+                        np.array([low[1], high[1]]))
+
+        side = self._shape[0]
+        slices = [self._order[self._offsets[row * side + first_column]:
+                              self._offsets[row * side + last_column + 1]]
+                  for row in range(int(first_row), int(last_row) + 1)]
+        candidates = np.concatenate(slices)
+        x, y = self.points[candidates, 0], self.points[candidates, 1]
+        inside = (x >= low[0]) & (x <= high[0]) & \
+            (y >= low[1]) & (y <= high[1])
+        return np.sort(candidates[inside])
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'doctest', 'python_ta', 'typing',
+            'math', 'numpy'
+        ]
+    })
@@ -16,14 +16,32 @@ There's quite a bit in this file, but you aren't responsible for most of it.
 It also contains the Map class, which is responsible for converting between
 long/lat coordinates and pixel coordinates on the pygame window.
 
+Only the objects that are in view are drawn. The stations given to
+Visualizer.set_stations are kept in a spatial grid, so that finding the
+ones in view does not look at the others, and the other objects are culled
+by their position on the screen before they are drawn.
+
+When the map is zoomed out, nearby stations are drawn as one marker per
+cluster, sized by the total number of bikes of its stations, so that the
+number of sprites drawn does not grow with the number of stations. The
+clusters are computed once for each level of detail when the stations are
+set, on grids whose cells halve from one level to the next. Only the bike
+totals of the clusters are computed again at every frame, by one NumPy
+pass over the bikes of all the stations, since they change as the
+simulation runs.
+
 DO NOT CHANGE ANY CODE IN THIS FILE. You don't need to for this assignment,
 and in fact you aren't even submitting this file!
 """
 from datetime import datetime
+import math
 import os
-from typing import List, Tuple
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
 import pygame
-from bikeshare import Drawable
+from bikeshare import Drawable, Ride, Station, StationGroup, \
+    drawable_positions, group_stations
+from spatialgrid import SpatialGrid
 
 
 WHITE = (255, 255, 255)
@@ -35,26 +53,45 @@ MAP_MAX = (-73.471199, 45.425780)
 # Window size
 SCREEN_SIZE = (960, 787)
 
+# The size of the cells stations are clustered in, in screen pixels, at the
+# zoom where a level of detail is first used.
+CLUSTER_SIZE = 40
+# The zoom from which stations are drawn individually.
+CLUSTER_MAX_ZOOM = 3
+# The largest scale of a cluster marker, relative to a station sprite.
+CLUSTER_MAX_SCALE = 3
+
 
 class Visualizer:
     """Visualizer for the current state of a simulation.
     """
     # === Private attributes ===
-    # _screen: the pygame window that is shown to the user.
+    # _screen: the pygame window that is shown to the user, or an
+    #   off-screen surface if this visualizer is off-screen.
     # _mouse_down: whether the user is holding down a mouse button
     #   on the pygame window.
     # _map: the Map object responsible for converting between long/lat
     #   coordinates and the pixels of the visualization window.
+    # _offscreen: whether frames are drawn to an off-screen surface instead
+    #   of a window.
     _screen: pygame.Surface
     _mouse_down: bool
     _map: 'Map'
+    _offscreen: bool
 
-    def __init__(self) -> None:
+    def __init__(self, offscreen: bool = False) -> None:
         """Initialize this visualization.
+
+        If <offscreen> is True, no window is opened, and each frame is only
+        drawn to a surface that can be read with frame().
         """
         pygame.init()
-        self._screen = pygame.display.set_mode(
-            SCREEN_SIZE, pygame.HWSURFACE | pygame.DOUBLEBUF)
+        self._offscreen = offscreen
+        if offscreen:
+            self._screen = pygame.Surface(SCREEN_SIZE)
+        else:
+            self._screen = pygame.display.set_mode(
+                SCREEN_SIZE, pygame.HWSURFACE | pygame.DOUBLEBUF)
         self._screen.fill(WHITE)
         self._mouse_down = False
         self._map = Map(SCREEN_SIZE)
@@ -62,18 +99,39 @@ class Visualizer:
         # Initial render. Pass in datetime.now() as an dummy value.
         self.render_drawables([], datetime.now())
 
+    def set_stations(self, stations: List[Station]) -> None:
+        """Draw <stations> in every frame, under the other objects.
+
+        The stations are indexed by location once, so that only the ones in
+        view are drawn.
+        """
+        self._map.set_stations(stations)
+
     def render_drawables(self, drawables: List[Drawable],
                          time: datetime) -> None:
-        """Render the simulation objects to the screen for the given time."""
+        """Render the simulation objects to the screen for the given time.
+
+        The stations given to set_stations are drawn first, by
+        render_stations, so they must not be in <drawables> as well, or
+        they are drawn twice.
+        """
         # Draw the background map onto the screen
         self._screen.fill(WHITE)
         self._screen.blit(self._map.get_current_view(), (0, 0))
 
         # Add all of the objects onto the screen
+        self._map.render_stations(self._screen)
         self._map.render_objects(drawables, self._screen, time)
 
         # Show the new image
-        pygame.display.flip()
+        if not self._offscreen:
+            pygame.display.flip()
+
+    def frame(self) -> bytes:
+        """Return the pixels of the frame that was rendered last, as RGB
+        bytes in rows of SCREEN_SIZE[0] pixels.
+        """
+        return pygame.image.tostring(self._screen, 'RGB')
 
     def handle_window_events(self) -> bool:
         """Handle any user events triggered through the pygame window.
@@ -111,10 +169,44 @@ class Map:
         the minimum long/lat coordinates
     max_coords:
         the maximum long/lat coordinates
+    scale_sprites:
+        whether sprites are scaled up along with the map when zooming in
+    cluster_stations:
+        whether nearby stations are drawn as one marker when the zoom is
+        below CLUSTER_MAX_ZOOM
+    size_clusters:
+        whether cluster markers are scaled up with the total number of bikes
+        of their stations
     """
+    # === Private attributes ===
+    # _pyramid: the map image at decreasing resolutions, starting with the
+    #   full image and halving its size at each level while it is still at
+    #   least as large as the screen.
+    # _view: the last view returned by get_current_view, and the offsets
+    #   and zoom it was computed for, or None if there is no such view.
+    # _sprites: the sprite images that have been drawn so far, converted to
+    #   the pixel format of the display, for each sprite file and zoom level.
+    # _stations: the stations drawn by render_stations.
+    # _station_grid: a spatial grid of the locations of _stations.
+    # _station_groups: the StationGroups of _stations, each with the
+    #   positions in _stations of its members and their indices in it.
+    # _clusters: for each level of detail k, used from zoom 2 ** k, the
+    #   cluster of each station of _stations, the first station and the
+    #   number of stations of each cluster, and a spatial grid of the mean
+    #   locations of the stations of each cluster.
     image: pygame.image
     min_coords: Tuple[float, float]
     max_coords: Tuple[float, float]
+    scale_sprites: bool
+    _sprites: Dict[Tuple[str, float], pygame.Surface]
+    _pyramid: List[pygame.Surface]
+    _view: Optional[Tuple[Tuple[int, int, float], pygame.Surface]]
+    cluster_stations: bool
+    size_clusters: bool
+    _stations: List[Station]
+    _station_grid: SpatialGrid
+    _station_groups: List[Tuple[StationGroup, np.ndarray, np.ndarray]]
+    _clusters: List[Tuple[np.ndarray, np.ndarray, np.ndarray, SpatialGrid]]
 
     def __init__(self, screendims: Tuple[int, int]) -> None:
         """Initialize this map for the given screen dimensions.
@@ -128,21 +220,261 @@ class Map:
         self._yoffset = 0
         self._zoom = 1
         self.screensize = screendims
+        self.scale_sprites = False
+        self.cluster_stations = True
+        self.size_clusters = True
+        self._sprites = {}
+        self._pyramid = _make_pyramid(self.image, screendims)
+        self._view = None
+        self.set_stations([])
+
+    def set_stations(self, stations: List[Station]) -> None:
+        """Set the stations drawn by render_stations to <stations>, index
+        them by location and cluster them for every level of detail.
+
+        This must be called again if the stations are moved to other
+        StationGroups. The stations that are not in any StationGroup yet
+        are put in a new one together.
+        """
+        self._stations = list(stations)
+        ungrouped = [station for station in self._stations
+                     if station.group is None]
+        if ungrouped:
+            group_stations(ungrouped)
+        self._station_grid = SpatialGrid(
+            np.array([station.location for station in self._stations]))
+
+        members = {}
+        for i, station in enumerate(self._stations):
+            members.setdefault(id(station.group), (station.group, [], []))
+            members[id(station.group)][1].append(i)
+            members[id(station.group)][2].append(station.index)
+        self._station_groups = [
+            (group, np.array(positions, dtype=np.int64),
+             np.array(indices, dtype=np.int64))
+            for group, positions, indices in members.values()]
+
+        levels = math.ceil(math.log2(CLUSTER_MAX_ZOOM)) \
+            if self._stations else 0
+        self._clusters = [self._make_clusters(level)
+                          for level in range(levels)]
+
+    def _make_clusters(self, level: int) -> \
+            Tuple[np.ndarray, np.ndarray, np.ndarray, SpatialGrid]:
+        """Return the clusters of the stations for the level of detail
+        <level>, as stored in _clusters.
+
+        Stations are in the same cluster if they are in the same cell of a
+        grid of the map image, whose cells are CLUSTER_SIZE screen pixels
+        wide and high at zoom 2 ** <level>.
+        """
+        width = self.image.get_width()
+        height = self.image.get_height()
+        points = self._station_grid.points
+        x = (points[:, 0] - self.min_coords[0]) / \
+            (self.max_coords[0] - self.min_coords[0]) * width
+        y = (points[:, 1] - self.min_coords[1]) / \
+            (self.max_coords[1] - self.min_coords[1]) * height
+        columns = np.floor(x * self.screensize[0] * 2 ** level /
+                           (CLUSTER_SIZE * width)).astype(np.int64)
+        rows = np.floor(y * self.screensize[1] * 2 ** level /
+                        (CLUSTER_SIZE * height)).astype(np.int64)
+
+        cells = np.stack([columns, rows], axis=1).reshape(-1, 2)
+        _, firsts, labels, counts = np.unique(
+            cells, axis=0, return_index=True, return_inverse=True,
+            return_counts=True)
+        labels = labels.reshape(-1)
+        centres = np.stack(
+            [np.bincount(labels, points[:, 0], len(counts)) / counts,
+             np.bincount(labels, points[:, 1], len(counts)) / counts],
+            axis=1)
+        return labels, firsts, counts, SpatialGrid(centres)
+
+    def render_stations(self, screen: pygame.Surface) -> None:
+        """Render the stations given to set_stations that are in view onto
+        the given screen, in the order they were given.
+
+        Below CLUSTER_MAX_ZOOM, if cluster_stations is True, a cluster of
+        stations is drawn as one marker instead, at the mean location of
+        its stations. A cluster of one station is drawn as the station.
+        """
+        if not self._stations:
+            return
+        margin = self._sprite_margin(
+            {station.sprite for station in self._stations})
+        if self.cluster_stations and self._zoom < CLUSTER_MAX_ZOOM:
+            self._render_clusters(screen, margin)
+            return
+        low, high = self._visible_bounds(margin)
+        indices = self._station_grid.query(low, high)
+        self._blit_visible(screen, [self._stations[i] for i in indices],
+                           self._station_grid.points[indices], margin)
+
+    def _render_clusters(self, screen: pygame.Surface,
+                         margin: Tuple[int, int]) -> None:
+        """Render the station clusters of the current level of detail that
+        are in view onto the given screen.
+
+        <margin> is the largest size of a station sprite.
+
+        The number of bikes of every station is summed into the clusters at
+        each call, which takes O(n) vectorized time for n stations; only
+        the clusters in view are drawn.
+        """
+        level = min(len(self._clusters) - 1,
+                    max(0, math.floor(math.log2(self._zoom))))
+        labels, firsts, counts, grid = self._clusters[level]
+        margin = (margin[0] * CLUSTER_MAX_SCALE,
+                  margin[1] * CLUSTER_MAX_SCALE)
+        low, high = self._visible_bounds(margin)
+        indices = grid.query(low, high)
+
+        bikes = np.zeros(len(self._stations))
+        for group, positions, group_indices in self._station_groups:
+            bikes[positions] = group.num_bikes[group_indices]
+        bikes = np.bincount(labels, bikes, len(counts))[indices]
+
+        positions = self.latlong_to_screen_array(grid.points[indices])
+        for i, bike_count, (x, y) in zip(indices.tolist(), bikes.tolist(),
+                                         positions.tolist()):
+            scale = 1
+            if counts[i] > 1 and self.size_clusters:
+                scale = min(CLUSTER_MAX_SCALE,
+                            round(1 + math.sqrt(bike_count) / 10, 1))
+            sprite = self._get_sprite(self._stations[firsts[i]].sprite,
+                                      scale)
+            if -sprite.get_width() < x < self.screensize[0] and \
+                    -sprite.get_height() < y < self.screensize[1]:
+                screen.blit(sprite, (x, y))
 
     def render_objects(self, drawables: List[Drawable],
                        screen: pygame.Surface, time: datetime) -> None:
         """Render the given objects onto the given screen.
 
-        Calculate their positions based on the given time.
+        Calculate their positions based on the given time. Objects whose
+        sprite would be entirely off the screen are not drawn. The rides
+        that are out of view for their whole trip are left out before any
+        position is computed.
+        """
+        margin = self._sprite_margin({drawable.sprite
+                                      for drawable in drawables})
+        drawables = self._cull_rides(drawables, margin)
+        self._blit_visible(screen, drawables,
+                           drawable_positions(drawables, time), margin)
+
+    def _cull_rides(self, drawables: List[Drawable],
+                    margin: Tuple[int, int]) -> List[Drawable]:
+        """Return <drawables> without the rides that cannot be drawn on the
+        screen with a sprite of size <margin> at any time.
+
+        A ride goes in a straight line from its start station to its end
+        station, so it is always inside the box around the two stations.
+        The rides whose box is outside the box of _visible_bounds are left
+        out.
         """
-        for drawable in drawables:
-            latlong_position = drawable.get_position(time)
-            sprite_position = self._latlong_to_screen(latlong_position)
-            sprite_file = os.path.join(os.path.dirname(__file__),
-                                       drawable.sprite)
-            screen.blit(pygame.image.load(sprite_file),
+        rides = [i for i, drawable in enumerate(drawables)
+                 if isinstance(drawable, Ride)]
+        if not rides:
+            return drawables
+        ends = np.array([drawables[i].start.location +
+                         drawables[i].end.location for i in rides],
+                        dtype=np.float64)
+        low, high = self._visible_bounds(margin)
+        out_of_view = \
+            (np.maximum(ends[:, 0], ends[:, 2]) < low[0]) | \
+            (np.minimum(ends[:, 0], ends[:, 2]) > high[0]) | \
+            (np.maximum(ends[:, 1], ends[:, 3]) < low[1]) | \
+            (np.minimum(ends[:, 1], ends[:, 3]) > high[1])
+        if not out_of_view.any():
+            return drawables
+        culled = set(np.array(rides)[out_of_view].tolist())
+        return [drawable for i, drawable in enumerate(drawables)
+                if i not in culled]
+
+    def _sprite_margin(self, sprites: Set[str]) -> Tuple[int, int]:
+        """Return the largest width and height of the given sprite files at
+        the current zoom level.
+        """
+        sizes = [self._get_sprite(sprite).get_size() for sprite in sprites]
+        return (max((size[0] for size in sizes), default=0),
+                max((size[1] for size in sizes), default=0))
+
+    def _blit_visible(self, screen: pygame.Surface,
+                      drawables: List[Drawable], locations: np.ndarray,
+                      margin: Tuple[int, int]) -> None:
+        """Draw the <drawables> at the long/lat <locations> onto <screen>,
+        except those that are more than <margin> pixels left of or above the
+        screen, or right of or below it.
+
+        A sprite is drawn with its top-left corner at its position, so none
+        of its pixels are on the screen in that case.
+        """
+        positions = self.latlong_to_screen_array(locations)
+        visible = np.flatnonzero(
+            (positions[:, 0] > -margin[0]) &
+            (positions[:, 0] < self.screensize[0]) &
+            (positions[:, 1] > -margin[1]) &
+            (positions[:, 1] < self.screensize[1]))
+        for i, sprite_position in zip(visible.tolist(),
+                                      positions[visible].tolist()):
+            screen.blit(self._get_sprite(drawables[i].sprite),
                         sprite_position)
 
+    def _visible_bounds(self, margin: Tuple[int, int]) -> \
+            Tuple[Tuple[float, float], Tuple[float, float]]:
+        """Return the smallest and largest long/lat coordinates of a box
+        that contains every location that is drawn on the screen with a
+        sprite of size <margin>.
+
+        The box is a few pixels larger than that on each side, so that
+        rounding to pixels never leaves a visible location out of it.
+        """
+        width = self.image.get_width()
+        height = self.image.get_height()
+        # The visible part of the image, in image pixels.
+        scale_x = width / (self._zoom * self.screensize[0])
+        scale_y = height / (self._zoom * self.screensize[1])
+        left = self._xoffset - (margin[0] + 2) * scale_x - 2
+        right = self._xoffset + (self.screensize[0] + 2) * scale_x + 2
+        top = self._yoffset - (margin[1] + 2) * scale_y - 2
+        bottom = self._yoffset + (self.screensize[1] + 2) * scale_y + 2
+
+        longs = [self.min_coords[0] + x / width *
+                 (self.max_coords[0] - self.min_coords[0])
+                 for x in (left, right)]
+        lats = [self.min_coords[1] + y / height *
+                (self.max_coords[1] - self.min_coords[1])
+                for y in (top, bottom)]
+        return (min(longs), min(lats)), (max(longs), max(lats))
+
+    def _get_sprite(self, sprite: str, scale: float = 1) -> pygame.Surface:
+        """Return the image to draw for the given sprite file at the current
+        zoom level, scaled up by <scale>.
+
+        Each sprite file is only loaded and converted once, and each scaled
+        version of it is only computed once per zoom level and scale.
+        """
+        level = round(self._zoom, 1) if self.scale_sprites else 1
+        level = round(level * scale, 1)
+        if (sprite, level) in self._sprites:
+            return self._sprites[(sprite, level)]
+
+        if (sprite, 1) not in self._sprites:
+            image = pygame.image.load(
+                os.path.join(os.path.dirname(__file__), sprite))
+            if pygame.display.get_surface() is not None:
+                image = image.convert_alpha()
+            self._sprites[(sprite, 1)] = image
+
+        image = self._sprites[(sprite, 1)]
+        if level != 1:
+            image = pygame.transform.smoothscale(
+                image, (round(image.get_width() * level),
+                        round(image.get_height() * level)))
+            self._sprites[(sprite, level)] = image
+        return image
+
     def _latlong_to_screen(self,
                            location: Tuple[float, float]) -> Tuple[int, int]:
         """Convert the given long/lat coordinates into pixel coordinates.
@@ -162,6 +494,27 @@ class Map:
                   self.image.get_height())
         return x, y
 
+    def latlong_to_screen_array(self, locations: np.ndarray) -> np.ndarray:
+        """Convert the long/lat coordinates in the rows of <locations> into
+        pixel coordinates.
+
+        Return an integer array with one (x, y) row per location, where each
+        row is what _latlong_to_screen returns for that location.
+        """
+        width = self.image.get_width()
+        height = self.image.get_height()
+        locations = np.asarray(locations, dtype=np.float64).reshape(-1, 2)
+        x = np.round((locations[:, 0] - self.min_coords[0]) /
+                     (self.max_coords[0] - self.min_coords[0]) * width)
+        y = np.round((locations[:, 1] - self.min_coords[1]) /
+                     (self.max_coords[1] - self.min_coords[1]) * height)
+
+        x = np.round((x - self._xoffset) * self._zoom * self.screensize[0] /
+                     width)
+        y = np.round((y - self._yoffset) * self._zoom * self.screensize[1] /
+                     height)
+        return np.stack([x, y], axis=1).astype(np.int64)
+
     def pan(self, dp: Tuple[int, int]) -> None:
         """Pan the view in the image by (dx, dy) screenspace pixels.
         """
@@ -193,15 +546,57 @@ class Map:
 
     def get_current_view(self) -> pygame.Surface:
         """Get the subimage to display to screen from the map.
+
+        The view is only computed again after the map is panned or zoomed.
+        It is scaled from the smallest level of the map pyramid that still
+        has at least one pixel for every pixel of the screen.
         """
+        transformation = (self._xoffset, self._yoffset, self._zoom)
+        if self._view is not None and self._view[0] == transformation:
+            return self._view[1]
+
         raw_width = self.image.get_width()
         raw_height = self.image.get_height()
         zoom_width = round(raw_width / self._zoom)
         zoom_height = round(raw_height / self._zoom)
 
-        mapsegment = self.image.subsurface(((self._xoffset, self._yoffset),
-                                            (zoom_width, zoom_height)))
-        return pygame.transform.smoothscale(mapsegment, self.screensize)
+        level = self._pyramid[0]
+        for image in self._pyramid[1:]:
+            if zoom_width * image.get_width() < \
+                    self.screensize[0] * raw_width or \
+                    zoom_height * image.get_height() < \
+                    self.screensize[1] * raw_height:
+                break
+            level = image
+
+        # Convert the visible region to the pixels of the chosen level.
+        x = self._xoffset * level.get_width() // raw_width
+        y = self._yoffset * level.get_height() // raw_height
+        width = min(level.get_width() - x,
+                    round(zoom_width * level.get_width() / raw_width))
+        height = min(level.get_height() - y,
+                     round(zoom_height * level.get_height() / raw_height))
+
+        mapsegment = level.subsurface(((x, y), (width, height)))
+        view = pygame.transform.smoothscale(mapsegment, self.screensize)
+        if pygame.display.get_surface() is not None:
+            view = view.convert()
+        self._view = (transformation, view)
+        return view
+
+
+def _make_pyramid(image: pygame.Surface,
+                  screendims: Tuple[int, int]) -> List[pygame.Surface]:
+    """Return <image> followed by copies of it at half the size of the
+    previous one, for as long as the copies are at least <screendims> large.
+    """
+    pyramid = [image]
+    while pyramid[-1].get_width() // 2 >= screendims[0] and \
+            pyramid[-1].get_height() // 2 >= screendims[1]:
+        pyramid.append(pygame.transform.smoothscale(
+            pyramid[-1], (pyramid[-1].get_width() // 2,
+                          pyramid[-1].get_height() // 2)))
+    return pyramid
 
 
 if __name__ == '__main__':
@@ -209,8 +604,8 @@ if __name__ == '__main__':
     python_ta.check_all(config={
         'allowed-import-modules': [
             'doctest', 'python_ta', 'typing',
-            'datetime', 'os', 'pygame',
-            'bikeshare'
+            'datetime', 'math', 'os', 'numpy', 'pygame',
+            'bikeshare', 'spatialgrid'
         ],
         'generated-members': 'pygame.*'
     })